@@ -1,13 +1,124 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks, Query, Request, Response, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, ConfigDict, Field
+from typing import IO, Dict, List, Optional, Tuple, Union
+import os
+import base64
+import hashlib
+import re
 import secrets
-import uuid
 import asyncio
-
-from db import get_supabase
-
-router = APIRouter(prefix="/qaz", tags=["Admin"])
+import logging
+import functools
+import time
+from collections import deque
+from fastapi.websockets import WebSocketState
+from enum import Enum
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from postgrest.types import ReturnMethod
+from PIL import Image
+import io
+
+from db import get_async_supabase
+from key_cache import get_key_cache, TokenLoader
+import auth
+from rate_limit import RateLimiter, TokenBucketLimiter
+from mjpeg_stream import FrameBroadcaster
+import metrics
+from providers.copilot_provider import CopilotProvider
+from copilot_session import CopilotSessionManager
+from proxy_manager import get_proxy_manager
+from provider_state import get_provider_state_manager
+from opencode_terminal import get_terminal_manager, push_line
+
+# The browser portals need Playwright, which is optional
+try:
+    from copilot_portal import get_portal
+    from browser_portal import get_portal_manager, PortalProvider, PORTAL_CONFIGS
+except ImportError:
+    get_portal = get_portal_manager = PortalProvider = PORTAL_CONFIGS = None
+
+logger = logging.getLogger("kai_api.admin")
+
+# Per-client token bucket for /qaz routes: bursts of 120, 20 req/s sustained,
+# so one client can't flood Supabase. Clients are keyed by forwarded IP
+# (rate_limit.client_ip). Streams and the dashboard's in-memory polls are
+# exempt: they never touch the DB and would otherwise eat the bucket.
+ADMIN_RATE_LIMIT_EXEMPT = frozenset({
+    "/qaz/portal/{provider}/screenshot",
+    "/qaz/portal/{provider}/stream",
+    "/qaz/portal/status",
+    "/qaz/copilot/portal/screenshot",
+    "/qaz/copilot/portal/status",
+    "/qaz/terminal/output",
+    "/qaz/terminal/ws",
+    "/qaz/terminal/status",
+})
+_admin_limiter = TokenBucketLimiter(rate=20, capacity=120, exempt=ADMIN_RATE_LIMIT_EXEMPT)
+
+router = APIRouter(
+    prefix="/qaz",
+    tags=["Admin"],
+    default_response_class=ORJSONResponse,
+    dependencies=[Depends(_admin_limiter.dependency)],
+)
+
+# Columns fetched from kaiapi_api_keys (avoid SELECT *)
+API_KEY_COLUMNS = "id,name,token,usage_tokens,limit_tokens,created_at,is_active"
+# id is kept for cache invalidation; token_hash only to match batched lookups (never returned)
+LOOKUP_KEY_COLUMNS = "id,token_hash,name,usage_tokens,limit_tokens,remaining,created_at,is_active"
+BULK_CREATE_MAX = 100  # keys per bulk_create request
+TOKEN_PREVIEW_LEN = 12  # chars of the token shown in the key list
+
+# Shape of tokens issued by create_key: sk-kai- + token_urlsafe(16)
+_TOKEN_RE = re.compile(r"sk-kai-[A-Za-z0-9_-]{22}")
+
+# Per-IP limit on /keys/lookup, so guessing tokens can't hammer the DB
+_lookup_limiter = RateLimiter(limit=20, window=60)
+
+# --- Token Buffer ---
+# Pre-generated API key tokens, kept topped up by a background task so
+# create_key doesn't generate one on the request path.
+
+TOKEN_BUFFER_SIZE = 128
+_token_buffer: deque = deque(maxlen=TOKEN_BUFFER_SIZE)
+_token_buffer_low = asyncio.Event()
+_token_buffer_task: Optional[asyncio.Task] = None
+
+def _new_token() -> str:
+    # Same output as "sk-kai-" + token_urlsafe(16), built in one bytes pass
+    return (b"sk-kai-" + base64.urlsafe_b64encode(secrets.token_bytes(16)).rstrip(b"=")).decode("ascii")
+
+async def _refill_token_buffer():
+    """Keep the token buffer full; wakes up whenever create_key takes one."""
+    while True:
+        while len(_token_buffer) < TOKEN_BUFFER_SIZE:
+            _token_buffer.append(_new_token())
+        _token_buffer_low.clear()
+        await _token_buffer_low.wait()
+
+# --- Lifecycle ---
+# Called once from main.py's lifespan (router-level on_event hooks are
+# deprecated, and on current FastAPI they fire twice).
+
+async def startup():
+    """Start the token buffer and create the managers the admin endpoints use."""
+    global _token_buffer_task
+    _token_buffer_task = asyncio.create_task(_refill_token_buffer())
+    # Warm the singletons so the first request doesn't pay for them
+    get_proxy_manager()
+    await get_provider_state_manager()
+    if get_portal_manager:
+        get_portal_manager()
+
+async def shutdown():
+    """Stop the token buffer, close pooled proxy clients, portal contexts and the shared Chromium."""
+    global _token_buffer_task
+    if _token_buffer_task:
+        _token_buffer_task.cancel()
+        _token_buffer_task = None
+    await get_proxy_manager().aclose()
+    if get_portal_manager:
+        await get_portal_manager().close_all()
 
 # --- Models ---
 
@@ -20,43 +131,140 @@ class APIKey(BaseModel):
     created_at: str
     is_active: bool
 
+class APIKeySummary(BaseModel):
+    """A key as shown in the list view: token is only its first TOKEN_PREVIEW_LEN chars."""
+    id: str
+    name: str
+    token: str
+    usage_tokens: int
+    limit_tokens: int
+    created_at: str
+    is_active: bool
+
 class CreateKeyRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    limit_tokens: Optional[int] = 1000000
+
+class BulkCreateKeysRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     name: str
     limit_tokens: Optional[int] = 1000000
+    count: int = Field(ge=1, le=BULK_CREATE_MAX)
 
 class LookupKeyRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     token: str
 
+class BulkKeysRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    ids: List[str]
+
 class PortalMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     message: str
 
-class PortalProviderRequest(BaseModel):
-    provider: str  # "copilot", "huggingchat", "chatgpt", "gemini", "zai"
+class ProviderName(str, Enum):
+    """Portal providers accepted in paths and bodies (mirrors browser_portal.PortalProvider)."""
+    copilot = "copilot"
+    huggingchat = "huggingchat"
+    chatgpt = "chatgpt"
+    gemini = "gemini"
+    zai = "zai"
 
-# --- Endpoints ---
+# ProviderName -> PortalProvider, resolved once (empty without Playwright)
+_PORTAL_PROVIDERS = {ProviderName(p.value): p for p in PortalProvider} if PortalProvider else {}
 
-@router.get("/keys", response_model=List[APIKey])
-async def list_keys():
-    """List all API keys."""
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-        
-    try:
-        res = supabase.table("kaiapi_api_keys").select("*").order("created_at", desc=True).execute()
-        return res.data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def _get_portal(provider: ProviderName):
+    """Get (or create) the browser portal for a provider."""
+    return get_portal_manager().get_portal(_PORTAL_PROVIDERS[provider])
 
-@router.post("/keys", response_model=APIKey)
-async def create_key(req: CreateKeyRequest):
-    """Create a new API key."""
-    supabase = get_supabase()
+class PortalProviderRequest(BaseModel):
+    provider: ProviderName
+
+# --- Key List Cache ---
+# The dashboard re-polls the key list; serve each page from memory for
+# KEYS_LIST_TTL seconds and drop them all whenever keys are created/revoked/reset.
+
+KEYS_LIST_TTL = 10  # seconds
+KEYS_PAGE_SIZE = 100
+KEYS_PAGE_MAX = 1000
+# (offset, limit) -> (expires_at, rows)
+_keys_list_cache: Dict[Tuple[int, int], Tuple[float, list]] = {}
+
+def _invalidate_keys_list():
+    _keys_list_cache.clear()
+
+# --- Key Lookup Batching ---
+
+def _token_hash(token: str) -> str:
+    """SHA-256 hex of a token, matching the generated token_hash column."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def _fetch_keys_by_token(tokens: List[str]) -> Dict[str, dict]:
+    """Fetch the rows for a batch of tokens in one query, matched by token hash."""
+    hashes = {_token_hash(token): token for token in tokens}
+    supabase = await get_async_supabase()
+    # At most one row per hash (unique index), so let Postgres stop as soon as it has them all
+    res = await (
+        supabase.table("kaiapi_api_keys")
+        .select(LOOKUP_KEY_COLUMNS)
+        .in_("token_hash", list(hashes))
+        .limit(len(hashes))
+        .execute()
+    )
+    return {hashes[row.pop("token_hash")]: row for row in res.data or []}
+
+_token_loader = TokenLoader(_fetch_keys_by_token)
+
+# --- Dependencies ---
+
+async def supabase_dep():
+    """Inject the shared async Supabase client (503 if unavailable)."""
+    supabase = await get_async_supabase()
     if not supabase:
         raise HTTPException(status_code=503, detail="Database unavailable")
+    return supabase
+
+# --- Endpoints ---
+
+# Rows come straight from Supabase, so the key endpoints document their shape
+# with responses= rather than re-validating every row through response_model
+@router.get("/keys", responses={200: {"model": List[APIKeySummary]}})
+async def list_keys(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(KEYS_PAGE_SIZE, ge=1, le=KEYS_PAGE_MAX),
+    supabase=Depends(supabase_dep),
+):
+    """List API keys, newest first, one page at a time."""
+    now = time.monotonic()
+    cached = _keys_list_cache.get((offset, limit))
+    if cached is not None and now < cached[0]:
+        return cached[1]
     
-    # Generate a secure token
-    token = f"sk-kai-{secrets.token_urlsafe(16)}"
+    res = await (
+        supabase.table("kaiapi_api_keys")
+        .select(API_KEY_COLUMNS)
+        .order("created_at", desc=True)
+        .range(offset, offset + limit - 1)
+        .execute()
+    )
+    # The list view only shows a token prefix; the full token is returned once, on create
+    rows = [{**row, "token": row["token"][:TOKEN_PREVIEW_LEN]} for row in res.data or []]
+    _keys_list_cache[(offset, limit)] = (now + KEYS_LIST_TTL, rows)
+    return rows
+
+@router.post("/keys", responses={200: {"model": APIKey}})
+async def create_key(req: CreateKeyRequest, supabase=Depends(supabase_dep)):
+    """Create a new API key."""
+    # Take a pre-generated token (fall back to generating one inline)
+    token = _token_buffer.popleft() if _token_buffer else _new_token()
+    _token_buffer_low.set()
     
     new_key = {
         "name": req.name,
@@ -66,317 +274,380 @@ async def create_key(req: CreateKeyRequest):
         "is_active": True
     }
     
-    try:
-        res = supabase.table("kaiapi_api_keys").insert(new_key).execute()
-        if res.data:
-            return res.data[0]
-        raise HTTPException(status_code=500, detail="Failed to create key")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # The inserted row comes back in the same round-trip (RETURNING), no re-read needed
+    res = await supabase.table("kaiapi_api_keys").insert(new_key, returning=ReturnMethod.representation).execute()
+    if res.data:
+        _invalidate_keys_list()
+        return res.data[0]
+    raise HTTPException(status_code=500, detail="Failed to create key")
+
+@router.post("/keys/bulk_create", responses={200: {"model": List[APIKey]}})
+async def bulk_create_keys(req: BulkCreateKeysRequest, supabase=Depends(supabase_dep)):
+    """Create several API keys with the same name/limit in a single insert."""
+    tokens = [_token_buffer.popleft() if _token_buffer else _new_token() for _ in range(req.count)]
+    _token_buffer_low.set()
+    
+    new_keys = [
+        {
+            "name": req.name,
+            "token": token,
+            "limit_tokens": req.limit_tokens,
+            "usage_tokens": 0,
+            "is_active": True
+        }
+        for token in tokens
+    ]
+    
+    res = await supabase.table("kaiapi_api_keys").insert(new_keys, returning=ReturnMethod.representation).execute()
+    if res.data:
+        _invalidate_keys_list()
+        return res.data
+    raise HTTPException(status_code=500, detail="Failed to create keys")
 
 @router.delete("/keys/{key_id}")
-async def revoke_key(key_id: str):
+async def revoke_key(key_id: str, supabase=Depends(supabase_dep)):
     """Revoke (delete) an API key."""
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-        
-    try:
-        # Check if exists first? Or just delete.
-        # Hard delete for now, or soft delete if we had is_active column logic in router update, but delete is cleaner for management
-        res = supabase.table("kaiapi_api_keys").delete().eq("id", key_id).execute()
-        return {"status": "success", "deleted": key_id}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Hard delete; the deleted row comes back (RETURNING), so a missing key is a 404 without a prior lookup
+    res = await supabase.table("kaiapi_api_keys").delete(returning=ReturnMethod.representation).eq("id", key_id).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Key not found")
+    
+    get_key_cache().invalidate_id(key_id)
+    auth.invalidate(key_id)
+    _invalidate_keys_list()
+    return {"status": "success", "deleted": res.data[0]["id"]}
 
 @router.post("/keys/{key_id}/reset")
-async def reset_usage(key_id: str):
+async def reset_usage(key_id: str, supabase=Depends(supabase_dep)):
     """Reset usage for a key."""
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-        
-    try:
-        supabase.table("kaiapi_api_keys").update({"usage_tokens": 0}).eq("id", key_id).execute()
-        return {"status": "reset"}
-    except Exception as e:
-         raise HTTPException(status_code=500, detail=str(e))
+    # Skip the write entirely when usage is already zero
+    res = await supabase.table("kaiapi_api_keys").update({"usage_tokens": 0}).eq("id", key_id).neq("usage_tokens", 0).execute()
+    if not res.data:
+        return {"status": "noop"}
+    
+    get_key_cache().invalidate_id(key_id)
+    auth.invalidate(key_id)
+    _invalidate_keys_list()
+    return {"status": "reset"}
+
+@router.post("/keys/bulk_revoke")
+async def bulk_revoke_keys(req: BulkKeysRequest, supabase=Depends(supabase_dep)):
+    """Revoke (delete) several API keys in a single query."""
+    if not req.ids:
+        return {"status": "success", "deleted": []}
+    
+    # RETURNING tells us which ids actually existed
+    res = await supabase.table("kaiapi_api_keys").delete(returning=ReturnMethod.representation).in_("id", req.ids).execute()
+    deleted = [row["id"] for row in res.data or []]
+    
+    cache = get_key_cache()
+    for key_id in deleted:
+        cache.invalidate_id(key_id)
+        auth.invalidate(key_id)
+    if deleted:
+        _invalidate_keys_list()
+    
+    deleted_set = {str(key_id) for key_id in deleted}
+    missing = [key_id for key_id in req.ids if key_id not in deleted_set]
+    return {"status": "success", "deleted": deleted, "missing": missing}
+
+@router.post("/keys/bulk_reset")
+async def bulk_reset_usage(req: BulkKeysRequest, supabase=Depends(supabase_dep)):
+    """Reset usage for several keys in a single query."""
+    if not req.ids:
+        return {"status": "reset", "ids": []}
+    
+    res = await supabase.table("kaiapi_api_keys").update({"usage_tokens": 0}).in_("id", req.ids).neq("usage_tokens", 0).execute()
+    reset_ids = [str(row["id"]) for row in res.data or []]
+    if reset_ids:
+        cache = get_key_cache()
+        for key_id in reset_ids:
+            cache.invalidate_id(key_id)
+            auth.invalidate(key_id)
+        _invalidate_keys_list()
+    return {"status": "reset", "ids": reset_ids}
+
+def lookup_token_dep(req: LookupKeyRequest) -> str:
+    """The lookup token, if it has the shape create_key issues (400 otherwise, before any DB work)."""
+    if not _TOKEN_RE.fullmatch(req.token):
+        raise HTTPException(status_code=400, detail="Invalid token format")
+    return req.token
 
 @router.post("/keys/lookup")
-async def lookup_key_by_token(req: LookupKeyRequest):
+async def lookup_key_by_token(
+    _=Depends(_lookup_limiter.dependency),
+    token: str = Depends(lookup_token_dep),
+    supabase=Depends(supabase_dep),
+):
     """Lookup API key usage by token (for public dashboard)."""
-    supabase = get_supabase()
-    if not supabase:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    
-    if not req.token or not req.token.startswith("sk-"):
-        raise HTTPException(status_code=400, detail="Invalid token format")
+    cache = get_key_cache()
+    key = cache.get(token)
     
-    try:
-        res = supabase.table("kaiapi_api_keys").select("*").eq("token", req.token).execute()
-        
-        if not res.data or len(res.data) == 0:
+    if key is None:
+        try:
+            key = await _token_loader.load(token)
+        except Exception as e:
+            error_msg = getattr(e, "message", None) or (str(e.args[0]) if e.args else str(e))
+            raise HTTPException(status_code=500, detail=error_msg)
+        
+        if key is None:
             raise HTTPException(status_code=404, detail="Key not found")
         
-        key = res.data[0]
-        
-        # Return limited info (don't expose full token)
-        return {
-            "name": key.get("name"),
-            "usage_tokens": key.get("usage_tokens", 0),
-            "limit_tokens": key.get("limit_tokens", 0),
-            "remaining": key.get("limit_tokens", 0) - key.get("usage_tokens", 0),
-            "created_at": key.get("created_at"),
-            "is_active": key.get("is_active", True)
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        if hasattr(e, 'message'):
-            error_msg = str(e.message)
-        elif hasattr(e, 'args') and len(e.args) > 0:
-            error_msg = str(e.args[0])
-        raise HTTPException(status_code=500, detail=error_msg)
+        cache.set(token, key)
+    
+    # Return limited info (don't expose full token)
+    return {
+        "name": key.get("name"),
+        "usage_tokens": key.get("usage_tokens", 0),
+        "limit_tokens": key.get("limit_tokens", 0),
+        "remaining": key.get("remaining", 0),
+        "created_at": key.get("created_at"),
+        "is_active": key.get("is_active", True)
+    }
 
 # --- Copilot CAPTCHA Handling ---
 
+CAPTCHA_SCREENSHOT_PATH = "/tmp/copilot_captcha.png"
+CAPTCHA_STAT_TTL = 1.0  # seconds
+CAPTCHA_SOLVE_TIMEOUT = 30  # seconds to wait for the challenge to clear
+SCREENSHOT_DEBOUNCE = 0.5  # seconds; reuse a portal screenshot younger than this
+
+# Last os.path.exists() result for the CAPTCHA screenshot (the dashboard polls it)
+_captcha_stat = {"checked_at": 0.0, "exists": False}
+
+def _captcha_screenshot_exists() -> bool:
+    """Check for the CAPTCHA screenshot, re-stat'ing at most once per CAPTCHA_STAT_TTL."""
+    now = time.monotonic()
+    if now - _captcha_stat["checked_at"] >= CAPTCHA_STAT_TTL:
+        _captcha_stat["exists"] = os.path.exists(CAPTCHA_SCREENSHOT_PATH)
+        _captcha_stat["checked_at"] = now
+    return _captcha_stat["exists"]
+
+def _clear_captcha_stat():
+    """Force the next check to hit the filesystem (after CAPTCHA state changes)."""
+    _captcha_stat["checked_at"] = 0.0
+
+def _conditional_file_response(request: Request, path: str, st: os.stat_result, media_type: str = "image/png"):
+    """Serve a file with an mtime/size ETag, or 304 if the client already has this version."""
+    etag = f'"{st.st_mtime_ns}-{st.st_size}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
+def _conditional_bytes_response(request: Request, data: bytes, media_type: str, etag: Optional[str] = None):
+    """Serve in-memory image bytes with an ETag (content hash by default), or 304 if the client has the same frame."""
+    etag = etag or f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
 @router.get("/copilot/captcha/status")
 async def copilot_captcha_status():
     """Check if Copilot has a pending CAPTCHA challenge."""
-    try:
-        from providers.copilot_provider import CopilotProvider
-        
-        is_pending = CopilotProvider.is_captcha_pending()
+    is_pending = CopilotProvider.is_captcha_pending()
+    
+    if is_pending:
+        # Check if screenshot exists (off the event loop)
+        has_screenshot = await asyncio.to_thread(_captcha_screenshot_exists)
         
-        if is_pending:
-            # Check if screenshot exists
-            import os
-            screenshot_path = "/tmp/copilot_captcha.png"
-            has_screenshot = os.path.exists(screenshot_path)
-            
-            return {
-                "captcha_required": True,
-                "has_screenshot": has_screenshot,
-                "screenshot_url": "/qaz/copilot/captcha/screenshot" if has_screenshot else None,
-                "message": "CAPTCHA verification required. Please solve it in the admin panel."
-            }
-        else:
-            return {
-                "captcha_required": False,
-                "message": "No CAPTCHA pending"
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return {
+            "captcha_required": True,
+            "has_screenshot": has_screenshot,
+            "screenshot_url": "/qaz/copilot/captcha/screenshot" if has_screenshot else None,
+            "message": "CAPTCHA verification required. Please solve it in the admin panel."
+        }
+    else:
+        return {
+            "captcha_required": False,
+            "message": "No CAPTCHA pending"
+        }
 
 @router.get("/copilot/captcha/screenshot")
-async def copilot_captcha_screenshot():
+async def copilot_captcha_screenshot(request: Request):
     """Get the CAPTCHA screenshot for solving."""
-    import os
-    from fastapi.responses import FileResponse
-    
-    screenshot_path = "/tmp/copilot_captcha.png"
-    
-    if not os.path.exists(screenshot_path):
+    try:
+        # One stat, off the event loop; FileResponse reuses it instead of stat'ing again
+        st = await asyncio.to_thread(os.stat, CAPTCHA_SCREENSHOT_PATH)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="No CAPTCHA screenshot available")
     
-    return FileResponse(screenshot_path, media_type="image/png")
+    return _conditional_file_response(request, CAPTCHA_SCREENSHOT_PATH, st)
 
-@router.post("/copilot/captcha/solved")
-async def copilot_captcha_solved():
-    """Mark CAPTCHA as solved and save session."""
+async def _save_captcha_session(context):
+    """Persist cookies from a solved CAPTCHA context, then close it (runs after the response)."""
     try:
-        from providers.copilot_provider import CopilotProvider
-        from copilot_session import CopilotSessionManager
-        
-        # Get the context with CAPTCHA
-        context = CopilotProvider.get_captcha_context()
-        
-        if not context:
-            raise HTTPException(status_code=400, detail="No CAPTCHA context found")
-        
-        # Wait a bit for user to solve
-        await asyncio.sleep(2)
-        
-        # Save cookies from the solved session
         cookies = await context.cookies()
         session_mgr = CopilotSessionManager()
-        session_mgr.save_cookies(cookies)
-        
-        # Clear the pending state
-        CopilotProvider.clear_captcha_pending()
-        
-        # Close the context
-        await context.close()
-        
-        return {
-            "status": "success",
-            "message": "CAPTCHA solved and session saved"
-        }
+        await asyncio.to_thread(session_mgr.save_cookies, cookies)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"❌ Failed to save Copilot session after CAPTCHA: {e}")
+    finally:
+        await context.close()
+
+@router.post("/copilot/captcha/solved", status_code=202)
+async def copilot_captcha_solved(background_tasks: BackgroundTasks):
+    """Mark CAPTCHA as solved; the session is saved in the background."""
+    # Get the context with CAPTCHA
+    context = CopilotProvider.get_captcha_context()
+    
+    if not context:
+        raise HTTPException(status_code=400, detail="No CAPTCHA context found")
+    
+    # Wait for the challenge to disappear from the page (returns at once if already solved)
+    if not await CopilotProvider.wait_for_captcha_cleared(timeout=CAPTCHA_SOLVE_TIMEOUT):
+        raise HTTPException(status_code=408, detail="CAPTCHA not solved yet. Try again once it is completed.")
+    
+    # Clear the pending state now; cookie saving and closing the context happen after we respond
+    CopilotProvider.clear_captcha_pending()
+    _clear_captcha_stat()
+    background_tasks.add_task(_save_captcha_session, context)
+    
+    return {
+        "status": "success",
+        "message": "CAPTCHA solved, saving session"
+    }
 
 @router.post("/copilot/captcha/clear")
 async def copilot_captcha_clear():
     """Clear the CAPTCHA pending state (for retry)."""
-    try:
-        from providers.copilot_provider import CopilotProvider
-        
-        # Get context and close it
-        context = CopilotProvider.get_captcha_context()
-        if context:
-            await context.close()
-        
-        CopilotProvider.clear_captcha_pending()
-        
-        return {
-            "status": "success",
-            "message": "CAPTCHA state cleared"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Get context and close it
+    context = CopilotProvider.get_captcha_context()
+    if context:
+        await context.close()
+    
+    CopilotProvider.clear_captcha_pending()
+    _clear_captcha_stat()
+    
+    return {
+        "status": "success",
+        "message": "CAPTCHA state cleared"
+    }
 
 @router.get("/copilot/session/status")
 async def copilot_session_status():
     """Check Copilot session status."""
-    try:
-        from copilot_session import CopilotSessionManager
-        
-        session_info = CopilotSessionManager.get_session_info()
-        return session_info
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    session_info = CopilotSessionManager.get_session_info()
+    return session_info
+
+@router.get("/dashboard")
+async def admin_dashboard(supabase=Depends(supabase_dep)):
+    """Keys, CAPTCHA and Copilot session status in one call (queried concurrently)."""
+    keys_res, has_screenshot, session_info = await asyncio.gather(
+        supabase.table("kaiapi_api_keys")
+            .select("id,name,usage_tokens,limit_tokens,is_active")
+            .order("created_at", desc=True)
+            .execute(),
+        asyncio.to_thread(_captcha_screenshot_exists),
+        asyncio.to_thread(CopilotSessionManager.get_session_info),
+    )
+    
+    return {
+        "keys": keys_res.data or [],
+        "captcha": {
+            "captcha_required": CopilotProvider.is_captcha_pending(),
+            "has_screenshot": has_screenshot,
+        },
+        "session": session_info,
+    }
 
 # --- Interactive Copilot Portal ---
 
 @router.post("/copilot/portal/start")
 async def start_copilot_portal():
     """Start the interactive Copilot browser portal."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        await portal.initialize()
-        
-        return {
-            "status": "success",
-            "message": "Portal started successfully",
-            "initialized": portal.is_initialized
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    await portal.initialize()
+    
+    return {
+        "status": "success",
+        "message": "Portal started successfully",
+        "initialized": portal.is_initialized
+    }
 
 @router.get("/copilot/portal/screenshot")
-async def get_portal_screenshot():
+async def get_portal_screenshot(request: Request):
     """Get the latest portal screenshot."""
-    import os
-    from fastapi.responses import FileResponse
+    portal = get_portal()
     
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    # Take a fresh screenshot unless the last one is still recent
     try:
-        from copilot_portal import get_portal
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        # Take fresh screenshot
-        await portal.take_screenshot()
-        
-        screenshot_path = "/tmp/copilot_portal.png"
-        if not os.path.exists(screenshot_path):
+        st = await asyncio.to_thread(os.stat, portal.last_screenshot)
+    except FileNotFoundError:
+        st = None
+    if st is None or time.time() - st.st_mtime >= SCREENSHOT_DEBOUNCE:
+        # take_screenshot() reports failure itself; the stat is only for the ETag/FileResponse
+        if not await portal.take_screenshot():
             raise HTTPException(status_code=404, detail="Screenshot not available")
-        
-        return FileResponse(screenshot_path, media_type="image/png")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        st = await asyncio.to_thread(os.stat, portal.last_screenshot)
+    
+    return _conditional_file_response(request, portal.last_screenshot, st)
 
 @router.post("/copilot/portal/send")
 async def send_portal_message(req: PortalMessage):
     """Send a message through the portal."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        response = await portal.send_message(req.message)
-        
-        return {
-            "status": "success",
-            "response": response
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    response = await portal.send_message(req.message)
+    
+    return {
+        "status": "success",
+        "response": response
+    }
 
 @router.post("/copilot/portal/newchat")
 async def portal_new_chat():
     """Click New Chat button in the portal."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        await portal.click_new_chat()
-        
-        return {
-            "status": "success",
-            "message": "New chat clicked"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    await portal.click_new_chat()
+    
+    return {
+        "status": "success",
+        "message": "New chat clicked"
+    }
 
 @router.post("/copilot/portal/refresh")
 async def portal_refresh():
     """Refresh the portal page."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        await portal.refresh_page()
-        
-        return {
-            "status": "success",
-            "message": "Page refreshed"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    await portal.refresh_page()
+    
+    return {
+        "status": "success",
+        "message": "Page refreshed"
+    }
 
 @router.post("/copilot/portal/close")
 async def close_copilot_portal():
     """Close the portal browser."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        await portal.close()
-        
-        return {
-            "status": "success",
-            "message": "Portal closed"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    await portal.close()
+    
+    return {
+        "status": "success",
+        "message": "Portal closed"
+    }
 
 
 @router.get("/copilot/portal/status")
 async def get_portal_status():
     """Check if the portal is currently running."""
     try:
-        from copilot_portal import get_portal
-        
         portal = get_portal()
         is_running = portal.is_running()
         
@@ -393,62 +664,50 @@ async def get_portal_status():
 
 
 class PortalClick(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     x: float
     y: float
 
 @router.post("/copilot/portal/click")
 async def portal_click(req: PortalClick):
     """Click at specific coordinates on the portal page."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        await portal.click_at_coordinates(req.x, req.y)
-        
-        return {
-            "status": "success",
-            "message": f"Clicked at coordinates ({req.x}, {req.y})"
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    await portal.click_at_coordinates(req.x, req.y)
+    
+    return {
+        "status": "success",
+        "message": f"Clicked at coordinates ({req.x}, {req.y})"
+    }
 
 
 @router.post("/copilot/portal/click_checkbox")
 async def portal_click_checkbox():
     """Click on the CAPTCHA checkbox (estimated position)."""
-    try:
-        from copilot_portal import get_portal
-        
-        portal = get_portal()
-        
-        if not portal.is_initialized:
-            raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
-        
-        # CAPTCHA checkbox is typically in the center of the screen
-        # Based on 1280x800 viewport, center is approximately (640, 400)
-        # The checkbox in your screenshot appears to be slightly above center
-        await portal.click_at_coordinates(640, 350)
-        
-        return {
-            "status": "success",
-            "message": "Clicked CAPTCHA checkbox area"
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = get_portal()
+    
+    if not portal.is_initialized:
+        raise HTTPException(status_code=400, detail="Portal not initialized. Start it first.")
+    
+    # CAPTCHA checkbox is typically in the center of the screen
+    # Based on 1280x800 viewport, center is approximately (640, 400)
+    # The checkbox in your screenshot appears to be slightly above center
+    await portal.click_at_coordinates(640, 350)
+    
+    return {
+        "status": "success",
+        "message": "Clicked CAPTCHA checkbox area"
+    }
 
 
 # --- NEW: Unified Browser Portal System for ALL Providers ---
 
 class UnifiedPortalAction(BaseModel):
-    provider: str  # "copilot", "huggingchat", "chatgpt", "gemini", "zai"
+    provider: ProviderName
     action: str    # "click", "type", "keypress", "scroll", "focus"
     x: Optional[float] = None
     y: Optional[float] = None
@@ -460,407 +719,395 @@ class UnifiedPortalAction(BaseModel):
 @router.post("/portal/start")
 async def start_unified_portal(req: PortalProviderRequest):
     """Start an interactive browser portal for any provider."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        provider = PortalProvider(req.provider.lower())
-        portal = get_portal_manager().get_portal(provider)
-        
-        if portal.is_running():
-            return {
-                "status": "already_running",
-                "provider": req.provider,
-                "message": f"{provider.value} portal is already running"
-            }
-        
-        await portal.initialize(headless=True)
-        
+    portal = _get_portal(req.provider)
+    
+    if portal.is_running():
         return {
-            "status": "success",
-            "provider": req.provider,
-            "message": f"{provider.value} portal started successfully",
-            "requires_login": portal.config.requires_login,
-            "url": portal.config.url
+            "status": "already_running",
+            "provider": req.provider.value,
+            "message": f"{req.provider.value} portal is already running"
         }
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    await portal.initialize()
+    
+    return {
+        "status": "success",
+        "provider": req.provider.value,
+        "message": f"{req.provider.value} portal started successfully",
+        "requires_login": portal.config.requires_login,
+        "url": portal.config.url
+    }
 
-@router.get("/portal/{provider}/screenshot")
-async def get_unified_portal_screenshot(provider: str, quality: float = 1.0, format: str = "png"):
-    """Get screenshot from any provider portal with optional quality/compression."""
-    import os
-    from fastapi.responses import FileResponse, StreamingResponse
-    from PIL import Image
-    import io
+STREAM_JPEG_QUALITY = 70
+
+def _encode_screenshot(
+    src: Union[str, IO[bytes]],
+    quality: float,
+    fmt: str,
+    jpeg_quality: int,
+    resample: Image.Resampling = Image.Resampling.LANCZOS,
+) -> Tuple[bytes, str]:
+    """Resize/re-encode a screenshot from a path or file object (CPU-bound; run via asyncio.to_thread)."""
+    img = Image.open(src)
     
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running. Start it first.")
-        
-        await portal.take_screenshot()
-        
-        if not os.path.exists(portal.screenshot_path):
-            raise HTTPException(status_code=404, detail="Screenshot not available")
-        
-        # If quality is 1.0 and format is png, return as-is
-        if quality >= 1.0 and format == "png":
-            return FileResponse(portal.screenshot_path, media_type="image/png")
-        
-        # Otherwise, compress/process the image
-        img = Image.open(portal.screenshot_path)
-        
-        # Resize if quality < 1.0
-        if quality < 1.0:
-            new_size = (int(img.width * quality), int(img.height * quality))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Convert to desired format
-        img_io = io.BytesIO()
-        if format == "jpeg" or format == "jpg":
+    # Resize if quality < 1.0
+    if quality < 1.0:
+        new_size = (int(img.width * quality), int(img.height * quality))
+        # JPEG sources decode straight at 1/2, 1/4 or 1/8 scale when that's enough (no-op for PNG)
+        img.draft("RGB", new_size)
+        img = img.resize(new_size, resample)
+    
+    # Convert to desired format
+    img_io = io.BytesIO()
+    if fmt == "jpeg" or fmt == "jpg":
+        # JPEG captures are already RGB; convert() would just copy the frame
+        if img.mode != "RGB":
             img = img.convert("RGB")
-            img.save(img_io, format="JPEG", quality=int(quality * 100) if quality < 1 else 85)
-            media_type = "image/jpeg"
-        else:
-            img.save(img_io, format="PNG")
-            media_type = "image/png"
-        
-        img_io.seek(0)
-        return StreamingResponse(img_io, media_type=media_type)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        img.save(img_io, format="JPEG", quality=jpeg_quality)
+        return img_io.getvalue(), "image/jpeg"
+    img.save(img_io, format="PNG")
+    return img_io.getvalue(), "image/png"
 
+# (provider, quality) -> (frame_id, downscaled JPEG) of the last frame served at that size
+_scaled_frames: Dict[Tuple[ProviderName, float], Tuple[int, bytes]] = {}
 
-# MJPEG Streaming endpoint for video-like experience
-@router.get("/portal/{provider}/stream")
-async def stream_portal_video(provider: str, quality: float = 0.5, fps: int = 2):
-    """Stream the portal as MJPEG for video-like experience."""
-    import os
-    import asyncio
-    from fastapi.responses import StreamingResponse
-    from PIL import Image
-    import io
+@router.get("/portal/{provider}/screenshot")
+async def get_unified_portal_screenshot(request: Request, provider: ProviderName, quality: float = 1.0, format: str = "png"):
+    """Get screenshot from any provider portal with optional quality/compression."""
+    portal = _get_portal(provider)
     
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running")
-        
-        async def generate_frames():
-            """Generate MJPEG stream."""
-            frame_delay = 1.0 / fps
-            
-            while portal.is_running():
-                try:
-                    # Take screenshot
-                    await portal.take_screenshot()
-                    
-                    if os.path.exists(portal.screenshot_path):
-                        # Process image
-                        img = Image.open(portal.screenshot_path)
-                        
-                        if quality < 1.0:
-                            new_size = (int(img.width * quality), int(img.height * quality))
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-                        
-                        # Convert to JPEG for smaller size
-                        img = img.convert("RGB")
-                        img_io = io.BytesIO()
-                        img.save(img_io, format="JPEG", quality=70)
-                        img_io.seek(0)
-                        
-                        frame_data = img_io.getvalue()
-                        
-                        # Yield MJPEG frame
-                        yield (
-                            b'--frame\r\n'
-                            b'Content-Type: image/jpeg\r\n'
-                            b'Content-Length: ' + str(len(frame_data)).encode() + b'\r\n'
-                            b'\r\n' + frame_data + b'\r\n'
-                        )
-                    
-                    await asyncio.sleep(frame_delay)
-                    
-                except Exception as e:
-                    print(f"Stream error: {e}")
-                    await asyncio.sleep(frame_delay)
-        
-        return StreamingResponse(
-            generate_frames(),
-            media_type="multipart/x-mixed-replace;boundary=frame"
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running. Start it first.")
+    
+    is_jpeg = format == "jpeg" or format == "jpg"
+    jpeg_quality = int(quality * 100) if quality < 1 else 85
+    
+    # JPEG comes from the portal's frame cache (recaptured only when the page
+    # changed), so an unchanged page costs no capture and no re-encode
+    if is_jpeg:
+        frame = await portal.current_frame()
+        if frame is None:
+            raise HTTPException(status_code=404, detail="Screenshot not available")
+        frame_id, raw = frame
+        etag = f'"{provider.value}-{frame_id}-{quality}"'
+        if quality >= 1.0:
+            return _conditional_bytes_response(request, raw, "image/jpeg", etag)
+        
+        key = (provider, quality)
+        cached = _scaled_frames.get(key)
+        if cached is None or cached[0] != frame_id:
+            data, _ = await asyncio.to_thread(
+                _encode_screenshot, io.BytesIO(raw), quality, format, jpeg_quality
+            )
+            cached = _scaled_frames[key] = (frame_id, data)
+        return _conditional_bytes_response(request, cached[1], "image/jpeg", etag)
+    
+    raw = await portal.take_screenshot_bytes()
+    if not raw:
+        raise HTTPException(status_code=404, detail="Screenshot not available")
+    
+    # Full size: already in the requested format
+    if quality >= 1.0:
+        return _conditional_bytes_response(request, raw, "image/png")
+    
+    # Otherwise, resize/re-encode in a worker thread
+    data, media_type = await asyncio.to_thread(
+        _encode_screenshot, io.BytesIO(raw), quality, format, jpeg_quality
+    )
+    return _conditional_bytes_response(request, data, media_type)
+
+
+def _encode_stream_frame(raw: bytes, quality: float) -> bytes:
+    """Downscale a captured JPEG frame. BILINEAR is plenty for a live preview and much cheaper than LANCZOS."""
+    frame, _ = _encode_screenshot(
+        io.BytesIO(raw), quality, "jpeg", STREAM_JPEG_QUALITY, Image.Resampling.BILINEAR
+    )
+    return frame
+
+def _new_frame_source(portal):
+    """Stream capture from the portal's frame cache: yields a frame only when it changed."""
+    last_id = None
+    
+    async def capture() -> bytes:
+        nonlocal last_id
+        frame = await portal.current_frame()
+        if frame is None or frame[0] == last_id:
+            return b""
+        last_id = frame[0]
+        return frame[1]
+    return capture
+
+# (provider, quality, fps) -> pipeline shared by every viewer of that stream
+_stream_broadcasters: Dict[Tuple[ProviderName, float, int], FrameBroadcaster] = {}
+
+# MJPEG Streaming endpoint for video-like experience
+@router.get("/portal/{provider}/stream")
+async def stream_portal_video(
+    provider: ProviderName,
+    quality: float = Query(0.5, gt=0, le=1),
+    fps: int = Query(2, ge=1, le=30),
+):
+    """Stream the portal as MJPEG for video-like experience."""
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running")
+    
+    key = (provider, quality, fps)
+    broadcaster = _stream_broadcasters.get(key)
+    if broadcaster is None:
+        # Frames are captured as JPEG; only re-encode (off the event loop) to downscale
+        broadcaster = _stream_broadcasters[key] = FrameBroadcaster(
+            capture=_new_frame_source(portal),
+            encode=None if quality >= 1.0 else functools.partial(_encode_stream_frame, quality=quality),
+            is_running=portal.is_running,
+            frame_delay=1.0 / fps,
         )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def generate_frames():
+        """Generate MJPEG stream from the shared broadcaster."""
+        # Keeps the portal's debounced captures running while this viewer is connected
+        portal.watch_frames()
+        try:
+            async for frame_data in broadcaster.subscribe():
+                # Yield MJPEG frame
+                yield (
+                    b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n'
+                    b'Content-Length: ' + str(len(frame_data)).encode() + b'\r\n'
+                    b'\r\n' + frame_data + b'\r\n'
+                )
+        finally:
+            portal.unwatch_frames()
+            if broadcaster.subscribers == 0 and _stream_broadcasters.get(key) is broadcaster:
+                del _stream_broadcasters[key]
+    
+    return StreamingResponse(
+        generate_frames(),
+        media_type="multipart/x-mixed-replace;boundary=frame"
+    )
+
+
+# --- Portal Actions ---
+# Each handler validates its own fields and returns a message for the response.
+
+async def _do_click(portal, req: UnifiedPortalAction) -> str:
+    if req.x is None or req.y is None:
+        raise HTTPException(status_code=400, detail="x and y coordinates required for click")
+    await portal.click(req.x, req.y)
+    return f"Clicked at ({req.x}, {req.y})"
+
+async def _do_type(portal, req: UnifiedPortalAction) -> str:
+    if not req.text:
+        raise HTTPException(status_code=400, detail="text required for type action")
+    await portal.type_text(req.text)
+    return f"Typed: {req.text[:50]}..." if len(req.text) > 50 else f"Typed: {req.text}"
+
+async def _do_keypress(portal, req: UnifiedPortalAction) -> str:
+    if not req.key:
+        raise HTTPException(status_code=400, detail="key required for keypress action")
+    await portal.key_press(req.key)
+    return f"Pressed key: {req.key}"
+
+async def _do_scroll(portal, req: UnifiedPortalAction) -> str:
+    await portal.scroll(req.delta_x or 0, req.delta_y or 0)
+    return f"Scrolled by ({req.delta_x}, {req.delta_y})"
+
+async def _do_focus(portal, req: UnifiedPortalAction) -> str:
+    if req.x is None or req.y is None:
+        raise HTTPException(status_code=400, detail="x and y coordinates required for focus")
+    await portal.focus_input(req.x, req.y)
+    return f"Focused input at ({req.x}, {req.y})"
+
+_PORTAL_ACTIONS = {
+    "click": _do_click,
+    "type": _do_type,
+    "keypress": _do_keypress,
+    "scroll": _do_scroll,
+    "focus": _do_focus,
+}
 
 @router.post("/portal/action")
 async def unified_portal_action(req: UnifiedPortalAction):
     """Perform an action on any provider portal."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        provider = PortalProvider(req.provider.lower())
-        portal = get_portal_manager().get_portal(provider)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{req.provider} portal not running. Start it first.")
-        
-        result = {}
-        
-        if req.action == "click":
-            if req.x is None or req.y is None:
-                raise HTTPException(status_code=400, detail="x and y coordinates required for click")
-            await portal.click(req.x, req.y)
-            result = {"message": f"Clicked at ({req.x}, {req.y})"}
-            
-        elif req.action == "type":
-            if not req.text:
-                raise HTTPException(status_code=400, detail="text required for type action")
-            await portal.type_text(req.text)
-            result = {"message": f"Typed: {req.text[:50]}..." if len(req.text) > 50 else f"Typed: {req.text}"}
-            
-        elif req.action == "keypress":
-            if not req.key:
-                raise HTTPException(status_code=400, detail="key required for keypress action")
-            await portal.key_press(req.key)
-            result = {"message": f"Pressed key: {req.key}"}
-            
-        elif req.action == "scroll":
-            await portal.scroll(req.delta_x or 0, req.delta_y or 0)
-            result = {"message": f"Scrolled by ({req.delta_x}, {req.delta_y})"}
-            
-        elif req.action == "focus":
-            if req.x is None or req.y is None:
-                raise HTTPException(status_code=400, detail="x and y coordinates required for focus")
-            await portal.focus_input(req.x, req.y)
-            result = {"message": f"Focused input at ({req.x}, {req.y})"}
-            
-        else:
-            raise HTTPException(status_code=400, detail=f"Unknown action: {req.action}")
-        
-        return {
-            "status": "success",
-            "provider": req.provider,
-            "action": req.action,
-            **result
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    handler = _PORTAL_ACTIONS.get(req.action)
+    if handler is None:
+        raise HTTPException(status_code=400, detail=f"Unknown action: {req.action}")
+    
+    portal = _get_portal(req.provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{req.provider.value} portal not running. Start it first.")
+    
+    return {
+        "status": "success",
+        "provider": req.provider.value,
+        "action": req.action,
+        "message": await handler(portal, req)
+    }
+
 
 @router.post("/portal/{provider}/send")
-async def unified_portal_send_message(provider: str, req: PortalMessage):
+async def unified_portal_send_message(provider: ProviderName, req: PortalMessage):
     """Send a message through any provider portal."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running. Start it first.")
-        
-        response = await portal.send_message(req.message)
-        
-        return {
-            "status": "success",
-            "provider": provider,
-            "response": response
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running. Start it first.")
+    
+    response = await portal.send_message(req.message)
+    
+    return {
+        "status": "success",
+        "provider": provider.value,
+        "response": response
+    }
 
 @router.post("/portal/{provider}/newchat")
-async def unified_portal_new_chat(provider: str):
+async def unified_portal_new_chat(provider: ProviderName):
     """Start new chat on any provider portal."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running. Start it first.")
-        
-        await portal.new_chat()
-        
-        return {
-            "status": "success",
-            "provider": provider,
-            "message": "New chat started"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running. Start it first.")
+    
+    await portal.new_chat()
+    
+    return {
+        "status": "success",
+        "provider": provider.value,
+        "message": "New chat started"
+    }
 
 @router.post("/portal/{provider}/close")
-async def close_unified_portal(provider: str):
-    """Close any provider portal."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        await portal.close()
-        
-        return {
-            "status": "success",
-            "provider": provider,
-            "message": f"{provider} portal closed"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def close_unified_portal(provider: ProviderName):
+    """Close any provider portal (its context stays warm for a quick restart)."""
+    await get_portal_manager().release(_PORTAL_PROVIDERS[provider])
+    
+    return {
+        "status": "success",
+        "provider": provider.value,
+        "message": f"{provider.value} portal closed"
+    }
+
+# PORTAL_CONFIGS is static, so only is_running needs computing per request
+_STATIC_PORTAL_INFO = {
+    provider: {
+        "provider": provider.value,
+        "name": config.name,
+        "requires_login": config.requires_login,
+        "url": config.url
+    }
+    for provider, config in (PORTAL_CONFIGS or {}).items()
+}
+
+async def _portal_status(provider, active_portals) -> dict:
+    """Status entry for one provider portal."""
+    return {**_STATIC_PORTAL_INFO[provider], "is_running": provider in active_portals}
 
 @router.get("/portal/status")
 async def get_all_portal_status():
     """Get status of all provider portals."""
-    try:
-        from browser_portal import get_portal_manager, PORTAL_CONFIGS
-        
-        manager = get_portal_manager()
-        active_portals = manager.get_active_portals()
-        
-        all_providers = []
-        for provider in PORTAL_CONFIGS.keys():
-            is_running = provider in active_portals
-            config = PORTAL_CONFIGS[provider]
-            all_providers.append({
-                "provider": provider.value,
-                "name": config.name,
-                "is_running": is_running,
-                "requires_login": config.requires_login,
-                "url": config.url
-            })
-        
-        return {
-            "providers": all_providers,
-            "active_count": len(active_portals)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    manager = get_portal_manager()
+    active_portals = manager.get_active_portals()
+    
+    # Built concurrently so per-provider liveness probes don't add up
+    all_providers = await asyncio.gather(
+        *(_portal_status(provider, active_portals) for provider in _STATIC_PORTAL_INFO)
+    )
+    
+    return {
+        "providers": list(all_providers),
+        "active_count": len(active_portals)
+    }
 
 
 # --- Browser Navigation Controls ---
 
 @router.post("/portal/{provider}/back")
-async def browser_go_back(provider: str):
+async def browser_go_back(provider: ProviderName):
     """Go back in browser history."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running")
-        
-        success = await portal.go_back()
-        url = await portal.get_current_url()
-        
-        return {
-            "status": "success" if success else "error",
-            "provider": provider,
-            "current_url": url,
-            "message": "Navigated back" if success else "Could not go back"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running")
+    
+    success = await portal.go_back()
+    url = await portal.get_current_url()
+    
+    return {
+        "status": "success" if success else "error",
+        "provider": provider.value,
+        "current_url": url,
+        "message": "Navigated back" if success else "Could not go back"
+    }
 
 @router.post("/portal/{provider}/forward")
-async def browser_go_forward(provider: str):
+async def browser_go_forward(provider: ProviderName):
     """Go forward in browser history."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running")
-        
-        success = await portal.go_forward()
-        url = await portal.get_current_url()
-        
-        return {
-            "status": "success" if success else "error",
-            "provider": provider,
-            "current_url": url,
-            "message": "Navigated forward" if success else "Could not go forward"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running")
+    
+    success = await portal.go_forward()
+    url = await portal.get_current_url()
+    
+    return {
+        "status": "success" if success else "error",
+        "provider": provider.value,
+        "current_url": url,
+        "message": "Navigated forward" if success else "Could not go forward"
+    }
 
 class NavigateRequest(BaseModel):
     url: str
 
 @router.post("/portal/{provider}/navigate")
-async def browser_navigate(provider: str, req: NavigateRequest):
+async def browser_navigate(provider: ProviderName, req: NavigateRequest):
     """Navigate to a specific URL."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running")
-        
-        success = await portal.goto_url(req.url)
-        url = await portal.get_current_url()
-        title = await portal.get_page_title()
-        
-        return {
-            "status": "success" if success else "error",
-            "provider": provider,
-            "url": url,
-            "title": title,
-            "message": f"Navigated to {req.url}" if success else f"Failed to navigate to {req.url}"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running")
+    
+    success = await portal.goto_url(req.url)
+    url = await portal.get_current_url()
+    title = await portal.get_page_title()
+    
+    return {
+        "status": "success" if success else "error",
+        "provider": provider.value,
+        "url": url,
+        "title": title,
+        "message": f"Navigated to {req.url}" if success else f"Failed to navigate to {req.url}"
+    }
 
 @router.get("/portal/{provider}/info")
-async def get_browser_info(provider: str):
+async def get_browser_info(provider: ProviderName):
     """Get current browser page info (URL and title)."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail=f"{provider} portal not running")
-        
-        url = await portal.get_current_url()
-        title = await portal.get_page_title()
-        
-        return {
-            "status": "success",
-            "provider": provider,
-            "url": url,
-            "title": title
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail=f"{provider.value} portal not running")
+    
+    url = await portal.get_current_url()
+    title = await portal.get_page_title()
+    
+    return {
+        "status": "success",
+        "provider": provider.value,
+        "url": url,
+        "title": title
+    }
+
+
+# --- Metrics ---
+
+@router.get("/metrics")
+async def get_metrics():
+    """In-process counters and latency histograms (auth cache, proxy probes)."""
+    return metrics.snapshot()
 
 
 # --- Proxy Management for Browser Portals ---
@@ -868,128 +1115,64 @@ async def get_browser_info(provider: str):
 @router.post("/proxy/fetch")
 async def fetch_new_proxies():
     """Fetch new free proxies and test them."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        
-        # Fetch new proxies
-        proxies = await proxy_mgr.fetch_proxies(limit=30)
-        
-        # Test first few to find a working one
-        working_proxy = await proxy_mgr.get_working_proxy(max_attempts=5)
-        
-        stats = proxy_mgr.get_proxy_stats()
-        
-        return {
-            "status": "success",
-            "message": f"Fetched {len(proxies)} proxies",
-            "working_proxy": str(working_proxy) if working_proxy else None,
-            "stats": stats
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    proxy_mgr = get_proxy_manager()
+    
+    # Fetch new proxies
+    proxies = await proxy_mgr.fetch_proxies(limit=30)
+    
+    # Test them all concurrently; the first to answer wins
+    working_proxy = await proxy_mgr.get_first_working_proxy(proxies)
+    
+    stats = proxy_mgr.get_proxy_stats()
+    
+    return {
+        "status": "success",
+        "message": f"Fetched {len(proxies)} proxies",
+        "working_proxy": str(working_proxy) if working_proxy else None,
+        "stats": stats
+    }
 
 @router.post("/proxy/rotate")
 async def rotate_proxy():
     """Rotate to a new working proxy."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        
-        # Rotate to new proxy
-        new_proxy = await proxy_mgr.rotate_proxy()
-        
-        if new_proxy:
-            return {
-                "status": "success",
-                "proxy": str(new_proxy),
-                "country": new_proxy.country,
-                "response_time": f"{new_proxy.response_time:.2f}s"
-            }
-        else:
-            raise HTTPException(status_code=503, detail="No working proxy available")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/proxy/status")
-async def get_proxy_status():
-    """Get current proxy status."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        
-        stats = proxy_mgr.get_proxy_stats()
-        current = proxy_mgr.get_current_proxy()
-        
-        return {
-            "current_proxy": str(current) if current else None,
-            **stats
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.post("/proxy/test")
-async def test_current_proxy():
-    """Test if current proxy is working."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        current = proxy_mgr.get_current_proxy()
-        
-        if not current:
-            raise HTTPException(status_code=400, detail="No proxy currently set")
-        
-        is_working = await proxy_mgr.test_proxy(current)
-        
+    proxy_mgr = get_proxy_manager()
+    
+    # Rotate to new proxy
+    new_proxy = await proxy_mgr.rotate_proxy()
+    
+    if new_proxy:
         return {
             "status": "success",
-            "proxy": str(current),
-            "is_working": is_working,
-            "response_time": f"{current.response_time:.2f}s" if is_working else None
+            "proxy": str(new_proxy),
+            "country": new_proxy.country,
+            "response_time": f"{new_proxy.response_time:.2f}s"
         }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    else:
+        raise HTTPException(status_code=503, detail="No working proxy available")
 
 @router.post("/portal/{provider}/restart-with-proxy")
-async def restart_portal_with_proxy(provider: str):
+async def restart_portal_with_proxy(provider: ProviderName):
     """Restart portal with current proxy."""
-    try:
-        from browser_portal import get_portal_manager, PortalProvider
-        from proxy_manager import get_proxy_manager
-        
-        prov = PortalProvider(provider.lower())
-        portal = get_portal_manager().get_portal(prov)
-        proxy_mgr = get_proxy_manager()
-        
-        # Get current proxy
-        current_proxy = proxy_mgr.get_current_proxy()
-        if not current_proxy:
-            raise HTTPException(status_code=503, detail="No custom proxy configured. Set one first.")
-        
-        # Close existing portal
-        await portal.close()
-        
-        # Reinitialize with proxy
-        await portal.initialize(headless=True, proxy=current_proxy)
-        
-        return {
-            "status": "success",
-            "provider": provider,
-            "proxy": str(current_proxy),
-            "message": f"{provider} portal restarted with proxy {current_proxy.ip}"
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    portal = _get_portal(provider)
+    proxy_mgr = get_proxy_manager()
+    
+    # Get current proxy
+    current_proxy = proxy_mgr.get_current_proxy()
+    if not current_proxy:
+        raise HTTPException(status_code=503, detail="No custom proxy configured. Set one first.")
+    
+    # Close existing portal
+    await portal.close()
+    
+    # Reinitialize with proxy
+    await portal.initialize(proxy=current_proxy)
+    
+    return {
+        "status": "success",
+        "provider": provider.value,
+        "proxy": str(current_proxy),
+        "message": f"{provider.value} portal restarted with proxy {current_proxy.ip}"
+    }
 
 
 # --- Provider Toggle Management ---
@@ -1001,48 +1184,36 @@ class ProviderToggleRequest(BaseModel):
 @router.get("/providers")
 async def get_providers():
     """Get all providers with their enabled/disabled status."""
-    try:
-        from provider_state import get_provider_state_manager
-        
-        manager = await get_provider_state_manager()
-        providers = manager.get_all_providers()
-        
-        return {
-            "providers": [
-                {
-                    "id": provider_id,
-                    "name": config["name"],
-                    "type": config["type"],
-                    "enabled": config["enabled"]
-                }
-                for provider_id, config in providers.items()
-            ]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    manager = await get_provider_state_manager()
+    providers = manager.get_all_providers()
+    
+    return {
+        "providers": [
+            {
+                "id": provider_id,
+                "name": config["name"],
+                "type": config["type"],
+                "enabled": config["enabled"]
+            }
+            for provider_id, config in providers.items()
+        ]
+    }
 
 @router.post("/providers/toggle")
 async def toggle_provider(req: ProviderToggleRequest):
     """Enable or disable a provider."""
-    try:
-        from provider_state import get_provider_state_manager
-        
-        manager = await get_provider_state_manager()
-        success = await manager.set_provider_state(req.provider_id, req.enabled)
-        
-        if success:
-            return {
-                "status": "success",
-                "provider_id": req.provider_id,
-                "enabled": req.enabled,
-                "message": f"Provider '{req.provider_id}' {'enabled' if req.enabled else 'disabled'}"
-            }
-        else:
-            raise HTTPException(status_code=400, detail=f"Failed to toggle provider '{req.provider_id}'")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    manager = await get_provider_state_manager()
+    success = await manager.set_provider_state(req.provider_id, req.enabled)
+    
+    if success:
+        return {
+            "status": "success",
+            "provider_id": req.provider_id,
+            "enabled": req.enabled,
+            "message": f"Provider '{req.provider_id}' {'enabled' if req.enabled else 'disabled'}"
+        }
+    else:
+        raise HTTPException(status_code=400, detail=f"Failed to toggle provider '{req.provider_id}'")
 
 
 # --- Custom Proxy Management ---
@@ -1055,80 +1226,56 @@ class SetProxyRequest(BaseModel):
 @router.post("/proxy/set")
 async def set_custom_proxy(req: SetProxyRequest):
     """Set a custom proxy for the entire container with optional authentication."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        success = proxy_mgr.set_custom_proxy(req.proxy, req.username, req.password)
-        
-        if success:
-            status = proxy_mgr.get_status()
-            return {
-                "status": "success",
-                "proxy": status["proxy"],
-                "has_auth": status.get("has_auth", False),
-                "username": status.get("username"),
-                "message": "Custom proxy set successfully"
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Invalid proxy format")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    proxy_mgr = get_proxy_manager()
+    success = proxy_mgr.set_custom_proxy(req.proxy, req.username, req.password)
+    
+    if success:
+        status = proxy_mgr.get_status()
+        return {
+            "status": "success",
+            "proxy": status["proxy"],
+            "has_auth": status.get("has_auth", False),
+            "username": status.get("username"),
+            "message": "Custom proxy set successfully"
+        }
+    else:
+        raise HTTPException(status_code=400, detail="Invalid proxy format")
 
 @router.post("/proxy/clear")
 async def clear_custom_proxy():
     """Clear the custom proxy."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        proxy_mgr.clear_proxy()
-        
-        return {
-            "status": "success",
-            "message": "Custom proxy cleared"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    proxy_mgr = get_proxy_manager()
+    proxy_mgr.clear_proxy()
+    
+    return {
+        "status": "success",
+        "message": "Custom proxy cleared"
+    }
 
 @router.get("/proxy/status")
 async def get_proxy_status():
     """Get current proxy status."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        status = proxy_mgr.get_status()
-        
-        return status
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    proxy_mgr = get_proxy_manager()
+    status = proxy_mgr.get_status()
+    
+    return status
 
 @router.post("/proxy/test")
 async def test_custom_proxy():
     """Test if the current custom proxy is working."""
-    try:
-        from proxy_manager import get_proxy_manager
-        
-        proxy_mgr = get_proxy_manager()
-        
-        if not proxy_mgr.get_current_proxy():
-            raise HTTPException(status_code=400, detail="No custom proxy configured")
-        
-        is_working = await proxy_mgr.test_proxy()
-        status = proxy_mgr.get_status()
-        
-        return {
-            "status": "success",
-            "is_working": is_working,
-            **status
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    proxy_mgr = get_proxy_manager()
+    
+    if not proxy_mgr.get_current_proxy():
+        raise HTTPException(status_code=400, detail="No custom proxy configured")
+    
+    is_working = await proxy_mgr.test_current_proxy()
+    status = proxy_mgr.get_status()
+    
+    return {
+        "status": "success",
+        "is_working": is_working,
+        **status
+    }
 
 
 # --- Saved Proxies Management ---
@@ -1144,129 +1291,76 @@ class ProxyCreateRequest(BaseModel):
     city: Optional[str] = None
     notes: Optional[str] = None
 
+def _proxy_row(req: ProxyCreateRequest) -> dict:
+    """Build a kaiapi_proxies row for a new (inactive) proxy."""
+    return {**req.model_dump(), "is_active": False}
+
 @router.get("/proxies")
 async def list_proxies():
     """Get all saved proxies from Supabase."""
     try:
-        from db import get_supabase
-        
-        supabase = get_supabase()
+        supabase = await get_async_supabase()
         if not supabase:
             return {"proxies": []}
         
-        res = supabase.table("kaiapi_proxies").select("*").order("created_at", desc=True).execute()
+        res = await supabase.table("kaiapi_proxies").select("*").order("created_at", desc=True).execute()
         return {"proxies": res.data or []}
     except Exception as e:
         logger.error(f"Failed to list proxies: {e}")
         return {"proxies": []}
 
-@router.post("/terminal/sync-auth")
-async def sync_terminal_auth(req: dict):
-    """Sync OpenCode auth to Supabase."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        manager = get_terminal_manager()
-        # Just use the default model to get an instance
-        portal = manager.get_portal("opencode-kimi-k2.5-free") 
-        success = await portal.sync_auth()
-        
-        if success:
-            return {"status": "success", "message": "Auth synced to Supabase"}
-        else:
-            return {"status": "error", "message": "Failed to sync auth (check logs)"}
-            
-    except Exception as e:
-        logger.error(f"Error syncing auth: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
 @router.post("/proxies")
-async def create_proxy(req: ProxyCreateRequest):
+async def create_proxy(req: ProxyCreateRequest, supabase=Depends(supabase_dep)):
     """Add a new proxy to Supabase."""
-    try:
-        from db import get_supabase
-        
-        supabase = get_supabase()
-        if not supabase:
-            raise HTTPException(status_code=503, detail="Database unavailable")
-        
-        proxy_data = {
-            "name": req.name,
-            "ip": req.ip,
-            "port": req.port,
-            "protocol": req.protocol,
-            "username": req.username,
-            "password": req.password,
-            "country": req.country,
-            "city": req.city,
-            "notes": req.notes,
-            "is_active": False
-        }
-        
-        res = supabase.table("kaiapi_proxies").insert(proxy_data).execute()
-        
-        return {
-            "status": "success",
-            "message": "Proxy saved",
-            "proxy": res.data[0] if res.data else None
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    res = await supabase.table("kaiapi_proxies").insert(_proxy_row(req)).execute()
+    
+    return {
+        "status": "success",
+        "message": "Proxy saved",
+        "proxy": res.data[0] if res.data else None
+    }
+
+@router.post("/proxies/bulk")
+async def bulk_create_proxies(
+    items: List[ProxyCreateRequest] = Body(..., max_length=BULK_CREATE_MAX),
+    supabase=Depends(supabase_dep),
+):
+    """Add several proxies in a single insert."""
+    if not items:
+        return {"status": "success", "count": 0, "proxies": []}
+    
+    res = await supabase.table("kaiapi_proxies").insert([_proxy_row(i) for i in items]).execute()
+    
+    return {
+        "status": "success",
+        "count": len(res.data or []),
+        "proxies": res.data or []
+    }
 
 @router.post("/proxies/{proxy_id}/activate")
-async def activate_proxy(proxy_id: int):
+async def activate_proxy(proxy_id: int, supabase=Depends(supabase_dep)):
     """Activate a saved proxy."""
-    try:
-        from db import get_supabase
-        from proxy_manager import get_proxy_manager
-        
-        supabase = get_supabase()
-        if not supabase:
-            raise HTTPException(status_code=503, detail="Database unavailable")
-        
-        res = supabase.table("kaiapi_proxies").select("*").eq("id", proxy_id).execute()
-        if not res.data:
-            raise HTTPException(status_code=404, detail="Proxy not found")
-        
-        proxy = res.data[0]
-        
-        # Deactivate all first
-        supabase.table("kaiapi_proxies").update({"is_active": False}).neq("id", proxy_id).execute()
-        
-        # Activate this one
-        supabase.table("kaiapi_proxies").update({"is_active": True}).eq("id", proxy_id).execute()
-        
-        # Set as current
-        proxy_mgr = get_proxy_manager()
-        proxy_str = f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}"
-        proxy_mgr.set_custom_proxy(proxy_str, proxy.get("username"), proxy.get("password"))
-        
-        return {"status": "success", "message": f"Proxy activated"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # One round-trip: the activate_proxy() function (supabase_proxies.sql)
+    # flips is_active for every row and returns the activated one
+    res = await supabase.rpc("activate_proxy", {"pid": proxy_id}).execute()
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Proxy not found")
+    
+    proxy = res.data[0]
+    
+    # Set as current
+    proxy_mgr = get_proxy_manager()
+    proxy_str = f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}"
+    proxy_mgr.set_custom_proxy(proxy_str, proxy.get("username"), proxy.get("password"))
+    
+    return {"status": "success", "message": f"Proxy activated"}
 
 @router.delete("/proxies/{proxy_id}")
-async def delete_proxy(proxy_id: int):
+async def delete_proxy(proxy_id: int, supabase=Depends(supabase_dep)):
     """Delete a saved proxy."""
-    try:
-        from db import get_supabase
-        
-        supabase = get_supabase()
-        if not supabase:
-            raise HTTPException(status_code=503, detail="Database unavailable")
-        
-        supabase.table("kaiapi_proxies").delete().eq("id", proxy_id).execute()
-        
-        return {"status": "success", "message": "Proxy deleted"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await supabase.table("kaiapi_proxies").delete().eq("id", proxy_id).execute()
+    
+    return {"status": "success", "message": "Proxy deleted"}
 
 
 # --- OpenCode Terminal Portal ---
@@ -1277,152 +1371,149 @@ class TerminalInput(BaseModel):
 class TerminalKey(BaseModel):
     key: str
 
+DEFAULT_TERMINAL_MODEL = "kimi-k2.5-free"
+
+def terminal_portal_dep(model: str = DEFAULT_TERMINAL_MODEL):
+    """Resolve the terminal portal for ?model= (404 for unknown models)."""
+    try:
+        return get_terminal_manager().get_portal(model)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def terminal_body_portal_dep(req: dict):
+    """Resolve the terminal portal for a JSON body's "model" field."""
+    return terminal_portal_dep(req.get("model", DEFAULT_TERMINAL_MODEL))
+
+@router.post("/terminal/sync-auth")
+async def sync_terminal_auth(portal=Depends(terminal_portal_dep)):
+    """Sync OpenCode auth to Supabase."""
+    # Any instance will do; the default model's is used unless ?model= is given
+    success = await portal.sync_auth()
+    
+    if success:
+        return {"status": "success", "message": "Auth synced to Supabase"}
+    else:
+        return {"status": "error", "message": "Failed to sync auth (check logs)"}
+
 @router.post("/terminal/start")
-async def start_terminal(req: dict):
+async def start_terminal(portal=Depends(terminal_body_portal_dep)):
     """Start OpenCode terminal session."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        model = req.get("model", "kimi-k2.5-free")
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
-        if portal.is_running():
-            return {
-                "status": "already_running",
-                "model": model,
-                "message": f"Terminal for {model} is already running"
-            }
-        
-        await portal.initialize()
-        
+    model = portal.config.model
+    
+    if portal.is_running():
         return {
-            "status": "success",
+            "status": "already_running",
             "model": model,
-            "message": f"Terminal started for {model}"
+            "message": f"Terminal for {model} is already running"
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    await portal.initialize()
+    
+    return {
+        "status": "success",
+        "model": model,
+        "message": f"Terminal started for {model}"
+    }
 
 @router.get("/terminal/output")
-async def get_terminal_output(model: str = "kimi-k2.5-free", lines: int = 100):
+async def get_terminal_output(lines: int = 100, portal=Depends(terminal_portal_dep)):
     """Get recent terminal output."""
     try:
-        from opencode_terminal import get_terminal_manager
-        
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
         if not portal.is_running():
             return {"lines": [], "status": "stopped"}
-            
-        output_lines = portal.get_output(max_lines=lines)
         
-        # Format for frontend
-        formatted_lines = [
-            {"type": stream, "content": line} 
-            for stream, line in output_lines
-        ]
-        
-        return {
-            "lines": formatted_lines,
-            "status": "running"
-        }
+        # Lines are stored pre-encoded, so the body is just concatenated
+        body = b'{"lines":' + portal.get_output_json(max_lines=lines) + b',"status":"running"}'
+        return Response(body, media_type="application/json")
     except Exception as e:
         return {"lines": [], "error": str(e), "status": "error"}
 
-@router.post("/terminal/input")
-async def send_terminal_input(req: TerminalInput, model: str = "kimi-k2.5-free"):
-    """Send text input to terminal."""
+@router.websocket("/terminal/ws")
+async def terminal_output_ws(websocket: WebSocket, portal=Depends(terminal_portal_dep)):
+    """Push new terminal output lines as {"type", "content"} JSON frames; closes when the terminal exits."""
+    await websocket.accept()
+    lines = portal.subscribe()
+    
+    async def watch_disconnect():
+        # Notice a client that leaves while the terminal is idle, not just on the next send
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            push_line(lines, None)
+    
+    watcher = asyncio.create_task(watch_disconnect())
     try:
-        from opencode_terminal import get_terminal_manager
-        
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
         if not portal.is_running():
-            raise HTTPException(status_code=400, detail="Terminal not running")
-            
-        success = await portal.send_input(req.text)
+            return
+        while (item := await lines.get()) is not None:
+            await websocket.send_text(item[2].decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        portal.unsubscribe(lines)
+        watcher.cancel()
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
+
+@router.post("/terminal/input")
+async def send_terminal_input(req: TerminalInput, portal=Depends(terminal_portal_dep)):
+    """Send text input to terminal."""
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail="Terminal not running")
         
-        return {"status": "success" if success else "error"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    success = await portal.send_input(req.text)
+    
+    return {"status": "success" if success else "error"}
 
 @router.post("/terminal/key")
-async def send_terminal_key(req: TerminalKey, model: str = "kimi-k2.5-free"):
+async def send_terminal_key(req: TerminalKey, portal=Depends(terminal_portal_dep)):
     """Send special key to terminal."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail="Terminal not running")
-            
-        success = await portal.send_key(req.key)
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail="Terminal not running")
         
-        return {"status": "success" if success else "error"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    success = await portal.send_key(req.key)
+    
+    return {"status": "success" if success else "error"}
 
 @router.post("/terminal/close")
-async def close_terminal(req: dict):
+async def close_terminal(portal=Depends(terminal_body_portal_dep)):
     """Close terminal session."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        model = req.get("model", "kimi-k2.5-free")
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
-        await portal.close()
-        
-        return {"status": "success", "message": "Terminal closed"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    await portal.close()
+    
+    return {"status": "success", "message": "Terminal closed"}
 
 
 @router.post("/terminal/reset")
-async def reset_terminal(req: dict):
+async def reset_terminal(portal=Depends(terminal_body_portal_dep)):
     """Manually trigger a full disposable reset (wipes all traces and starts fresh)."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        model = req.get("model", "kimi-k2.5-free")
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
-        if not portal.is_running():
-            raise HTTPException(status_code=400, detail="Terminal not running")
-        
-        success = await portal.manual_reset()
-        
-        return {
-            "status": "success" if success else "error",
-            "message": "Full disposable reset completed - OpenCode sees a brand new device!",
-            "model": model
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not portal.is_running():
+        raise HTTPException(status_code=400, detail="Terminal not running")
+    
+    success = await portal.manual_reset()
+    
+    return {
+        "status": "success" if success else "error",
+        "message": "Full disposable reset completed - OpenCode sees a brand new device!",
+        "model": portal.config.model
+    }
 
 
 @router.get("/terminal/status")
-async def get_terminal_status(model: str = "kimi-k2.5-free"):
+async def get_terminal_status(portal=Depends(terminal_portal_dep)):
     """Get disposable mode status and message count."""
-    try:
-        from opencode_terminal import get_terminal_manager
-        
-        manager = get_terminal_manager()
-        portal = manager.get_portal(model)
-        
-        status = portal.get_disposable_status()
-        
-        return {
-            "status": "success",
-            "data": status
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    status = portal.get_disposable_status()
+    
+    return {
+        "status": "success",
+        "data": status
+    }
 
@@ -4,14 +4,63 @@ Authentication Module
 Shared authentication logic for dashboard vs external API access.
 """
 
+import hmac
+import re
+import time
 from fastapi import HTTPException, Request, Header
 from typing import Optional
-from db import get_supabase
+from db import get_async_supabase
 from config import DEMO_API_KEY
+from key_cache import KeyCache
+import metrics
+
+_DEMO_KEY_BYTES = DEMO_API_KEY.encode()
 
 # List of allowed origins/paths that don't need API key (dashboard access)
-DASHBOARD_PATHS = ["/", "/docs/public", "/docs", "/static/"]
-DASHBOARD_HOSTS = ["localhost", "127.0.0.1"]  # Add your domain here when deployed
+DASHBOARD_PATHS = ("/", "/docs/public", "/docs", "/static/")
+DASHBOARD_HOSTS = ("localhost", "127.0.0.1")  # Add your domain here when deployed
+
+# One compiled scan per header instead of a loop of substring checks:
+# the referer may carry a dashboard path or host, the origin only a host
+_REFERER_RE = re.compile("|".join(re.escape(m) for m in DASHBOARD_PATHS + DASHBOARD_HOSTS))
+_ORIGIN_RE = re.compile("|".join(re.escape(h) for h in DASHBOARD_HOSTS))
+
+# Key rows seen by verify_api_key, so repeat requests skip the DB round-trip.
+# Kept short so quota checks trail usage by at most AUTH_CACHE_TTL seconds;
+# unknown tokens are cached briefly so guessing can't hammer the DB.
+AUTH_CACHE_TTL = 30
+AUTH_NEGATIVE_TTL = 5
+_MISS = object()
+_auth_cache = KeyCache(ttl=AUTH_CACHE_TTL, negative_ttl=AUTH_NEGATIVE_TTL)
+
+_cache_hits = metrics.counter("auth_cache_hits")
+_cache_misses = metrics.counter("auth_cache_misses")
+_db_latency = metrics.histogram("auth_db_lookup_latency_ms")
+
+def invalidate(key_id):
+    """Drop a key's cached auth row (after it is revoked or its usage is reset)."""
+    _auth_cache.invalidate_id(key_id)
+
+def _is_dashboard_request(request: Request) -> bool:
+    """Check if a keyless request is coming from the dashboard (same origin)."""
+    headers = request.headers
+    referer = headers.get("referer", "")
+    origin = headers.get("origin", "")
+    
+    if _REFERER_RE.search(referer) or _ORIGIN_RE.search(origin):
+        return True
+    
+    # Browser request (has Accept: text/html)
+    return bool(referer or origin) and "text/html" in headers.get("accept", "")
+
+async def _fetch_key(token: str) -> Optional[dict]:
+    """Fetch the key row for a token over the shared async client."""
+    supabase = await get_async_supabase()
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Service unavailable")
+
+    res = await supabase.table("kaiapi_api_keys").select("*").eq("token", token).limit(1).execute()
+    return res.data[0] if res.data else None
 
 async def verify_api_key(
     request: Request,
@@ -36,32 +85,8 @@ async def verify_api_key(
     if not token and x_api_key:
         token = x_api_key
     
-    # Check if request is coming from dashboard (same origin)
-    referer = request.headers.get("referer", "")
-    origin = request.headers.get("origin", "")
-    
-    # Check if referer/origin matches dashboard
-    is_dashboard_request = False
-    
-    # Check if referer contains dashboard paths
-    for path in DASHBOARD_PATHS:
-        if path in referer:
-            is_dashboard_request = True
-            break
-    
-    # Also check if origin is localhost (local development)
-    for host in DASHBOARD_HOSTS:
-        if host in origin or host in referer:
-            is_dashboard_request = True
-            break
-    
-    # Check if it's a browser request (has Accept: text/html)
-    accept_header = request.headers.get("accept", "")
-    if "text/html" in accept_header and (referer or origin):
-        is_dashboard_request = True
-    
     if not token:
-        if is_dashboard_request:
+        if _is_dashboard_request(request):
             # Dashboard access - no key needed
             return {"id": "dashboard", "name": "Dashboard User", "limit_tokens": -1, "is_dashboard": True}
         else:
@@ -72,25 +97,21 @@ async def verify_api_key(
             )
 
     # 1. Check Demo Key
-    if token == DEMO_API_KEY:
+    # Constant-time compare (bytes, so non-ASCII tokens can't raise)
+    if hmac.compare_digest(token.encode(), _DEMO_KEY_BYTES):
         return {"id": "demo", "name": "Demo User", "limit_tokens": -1, "is_dashboard": False}
 
-    # 2. Check Database (Non-blocking)
-    import asyncio
-    loop = asyncio.get_event_loop()
-    
-    def _sync_check():
-        supabase = get_supabase()
-        if not supabase:
-             raise HTTPException(status_code=503, detail="Service unavailable")
-             
-        res = supabase.table("kaiapi_api_keys").select("*").eq("token", token).execute()
-        if not res.data:
-            return None
-        return res.data[0]
-
+    # 2. Check Database
     try:
-        key_data = await loop.run_in_executor(None, _sync_check)
+        key_data = _auth_cache.get(token, _MISS)
+        if key_data is _MISS:
+            _cache_misses.inc()
+            start = time.perf_counter()
+            key_data = await _fetch_key(token)
+            _db_latency.observe((time.perf_counter() - start) * 1000)
+            _auth_cache.set(token, key_data)
+        else:
+            _cache_hits.inc()
         
         if not key_data:
              raise HTTPException(status_code=401, detail="Incorrect API key provided")
@@ -105,8 +126,8 @@ async def verify_api_key(
         if limit > 0 and current_usage >= limit:
              raise HTTPException(status_code=429, detail="You have exceeded your current quota")
              
-        key_data["is_dashboard"] = False
-        return key_data
+        # Copy so callers can't mutate the cached row
+        return {**key_data, "is_dashboard": False}
 
     except HTTPException:
         raise
@@ -13,15 +13,190 @@ Features:
 """
 
 import asyncio
+import base64
 import logging
 import json
-from typing import Optional, Dict, Any, Callable
-from playwright.async_api import async_playwright, Page, BrowserContext
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple, Any, Callable
+from playwright.async_api import async_playwright, Browser, Page, BrowserContext, CDPSession
 from dataclasses import dataclass
 from enum import Enum
 
 logger = logging.getLogger("kai_api.browser_portal")
 
+# Maximum stealth args with audio support (shared Chromium for all portals)
+BROWSER_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-features=IsolateOrigins,site-per-process",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-web-security",
+    "--disable-features=site-isolation",
+    "--disable-features=IsolateOrigins",
+    "--window-size=1280,800",
+    "--force-color-profile=srgb",
+    "--disable-extensions-except=",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--password-store=basic",
+    "--use-mock-keychain",
+    # Audio support
+    "--autoplay-policy=no-user-gesture-required",
+    "--use-fake-ui-for-media-stream",
+    "--use-fake-device-for-media-stream",
+    "--enable-features=AudioServiceOutOfProcess",
+    "--disable-features=AudioServiceSandbox",
+]
+
+# Stealth init script, read and minified once at import: whole-line comments,
+# indentation and blank lines are stripped so each new context gets less JS
+STEALTH_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_portal_stealth.js")
+
+def _minify_js(source: str) -> str:
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+with open(STEALTH_SCRIPT_PATH) as _f:
+    STEALTH_JS = _minify_js(_f.read())
+
+# Fill and submit a login form in a single DOM pass. Uses the native value
+# setter so framework-controlled inputs (React etc.) see the change.
+LOGIN_SCRIPT = """
+(creds) => {
+    const u = document.querySelector('input[type="email"], input[name="username"], input[type="text"]');
+    const p = document.querySelector('input[type="password"]');
+    const s = document.querySelector('button[type="submit"], input[type="submit"]');
+    if (!u || !p || !s) return false;
+    const setValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    for (const [el, value] of [[u, creds.u], [p, creds.p]]) {
+        el.focus();
+        setValue.call(el, value);
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    s.click();
+    return true;
+}
+"""
+
+# Generic chat input candidates, most common first
+CHAT_INPUT_SELECTORS = [
+    'textarea',
+    'div[contenteditable="true"]',
+    '[data-testid="chat-input"]',
+    '[role="textbox"]',
+    'input[type="text"]',
+]
+
+# Focus the first matching input; returns its 1-based index (falsy = keep polling)
+FOCUS_INPUT_SCRIPT = """
+(selectors) => {
+    for (let i = 0; i < selectors.length; i++) {
+        const el = document.querySelector(selectors[i]);
+        if (el) {
+            el.focus();
+            el.click();
+            return i + 1;
+        }
+    }
+    return 0;
+}
+"""
+
+# Generic reply containers, searched last-match-first by _extract_response
+RESPONSE_SELECTORS = [
+    '[data-message-author-role="assistant"]',
+    '.message-content',
+    '.ac-textBlock',
+    '[class*="response"]',
+    'article',
+]
+
+# Generic "new chat" buttons (Playwright selectors)
+NEW_CHAT_SELECTORS = [
+    'button:has-text("New chat")',
+    'button:has-text("New Chat")',
+    '[aria-label*="new chat" i]',
+]
+
+EXTRACT_RESPONSE_SCRIPT = """
+(selectors) => {
+    for (const sel of selectors) {
+        const els = document.querySelectorAll(sel);
+        if (els.length > 0) {
+            const last = els[els.length - 1];
+            const text = last.innerText || last.textContent || '';
+            if (text.trim().length > 10) return text.trim();
+        }
+    }
+    return '';
+}
+"""
+
+# Screenshots follow DOM changes: the page batches mutations/resizes per
+# animation frame and reports them to _on_dom_change, which marks the cached
+# frame stale. While a stream is watching, one screenshot is taken once the
+# page has been quiet for DOM_SETTLE_DELAY (or at least every
+# DOM_SETTLE_MAX_WAIT while it keeps changing, e.g. streaming)
+DOM_SETTLE_DELAY = 0.15
+DOM_SETTLE_MAX_WAIT = 1.0
+
+# Navigation waits for DOMContentLoaded, then for the DOM to stop changing
+# (chat sites hold SSE/long-poll connections open, so "networkidle" may never come)
+NAV_QUIET_WINDOW = 0.5
+NAV_QUIET_TIMEOUT = 5.0
+SEND_SETTLE_TIMEOUT = 2.0
+LOGIN_SETTLE_TIMEOUT = 5.0
+
+# Soft-closed portals park their context for reuse; the manager closes
+# them for real once idle this long (checked every PORTAL_EVICT_INTERVAL)
+PORTAL_IDLE_TTL = 600
+PORTAL_EVICT_INTERVAL = 60
+
+SCREENSHOT_JPEG_QUALITY = 70
+FRAME_CACHE_SIZE = 8  # recent screenshots kept per portal, by frame id
+FRAME_MAX_AGE = 5.0  # seconds a cached frame is trusted without a DOM change
+
+DOM_CHANGE_SCRIPT = """
+(() => {
+    if (window !== window.top || window.__kaiChangeObserver) return;
+    let pending = 0;
+    let scheduled = false;
+    const flush = () => {
+        scheduled = false;
+        const count = pending;
+        pending = 0;
+        if (window.__changeSink) window.__changeSink(count);
+    };
+    const note = () => {
+        pending++;
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(flush);
+        }
+    };
+    window.__kaiChangeObserver = new MutationObserver(note);
+    window.__kaiChangeObserver.observe(document, {
+        subtree: true,
+        childList: true,
+        characterData: true,
+        attributes: true,
+        attributeFilter: ['id', 'class', 'href', 'src', 'disabled', 'hidden', 'role',
+                          'aria-hidden', 'aria-expanded', 'aria-selected', 'aria-busy'],
+    });
+    const watchResize = () => new ResizeObserver(note).observe(document.documentElement);
+    if (document.documentElement) watchResize();
+    else document.addEventListener('DOMContentLoaded', watchResize, {once: true});
+})();
+"""
+
 
 class PortalProvider(Enum):
     COPILOT = "copilot"
@@ -47,6 +222,12 @@ class PortalConfig:
     viewport: Dict[str, int]
     credentials: Optional[PortalCredentials] = None
     requires_login: bool = False
+    # Known-good selectors for this site, tried before the generic ones.
+    # Brittle by nature (sites change their markup); a stale one only
+    # costs a miss before the generic fallback, so update them freely.
+    input_selector: Optional[str] = None
+    response_selector: Optional[str] = None
+    new_chat_selector: Optional[str] = None
 
 
 # Provider configurations
@@ -56,6 +237,9 @@ PORTAL_CONFIGS = {
         url="https://copilot.microsoft.com/",
         viewport={"width": 1280, "height": 800},
         requires_login=False,
+        input_selector="textarea#userInput",
+        response_selector=".ac-textBlock",
+        new_chat_selector='button[aria-label*="new chat" i]',
     ),
     PortalProvider.HUGGINGCHAT: PortalConfig(
         name="HuggingChat",
@@ -66,24 +250,32 @@ PORTAL_CONFIGS = {
             password="Zzzzz1$."
         ),
         requires_login=True,
+        input_selector='textarea[placeholder*="Ask"]',
+        new_chat_selector='a[href$="/chat/"]',
     ),
     PortalProvider.CHATGPT: PortalConfig(
         name="ChatGPT",
         url="https://chatgpt.com/",
         viewport={"width": 1280, "height": 800},
         requires_login=False,
+        input_selector="#prompt-textarea",
+        response_selector='[data-message-author-role="assistant"]',
+        new_chat_selector='[data-testid="create-new-chat-button"]',
     ),
     PortalProvider.GEMINI: PortalConfig(
         name="Google Gemini",
         url="https://gemini.google.com/",
         viewport={"width": 1280, "height": 800},
         requires_login=False,
+        input_selector='rich-textarea div[contenteditable="true"]',
+        response_selector="message-content",
     ),
     PortalProvider.ZAI: PortalConfig(
         name="Z.ai Chat",
         url="https://chat.z.ai/",
         viewport={"width": 1280, "height": 800},
         requires_login=False,
+        input_selector="textarea#chat-input",
     ),
 }
 
@@ -91,236 +283,245 @@ PORTAL_CONFIGS = {
 class BrowserPortal:
     """Full-featured browser with navigation and enhanced stealth."""
     
-    def __init__(self, provider: PortalProvider, config: PortalConfig):
+    def __init__(self, provider: PortalProvider, config: PortalConfig, manager: "PortalManager"):
         self.provider = provider
         self.config = config
-        self.browser = None
+        self._manager = manager
+        self.browser: Optional[Browser] = None  # shared, owned by the manager
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
-        self.playwright = None
+        self._cdp: Optional[CDPSession] = None  # direct CDP channel for screenshots/typing
         self.is_initialized = False
-        self.screenshot_path = f"/tmp/portal_{provider.value}.png"
-        self.on_screenshot_callback: Optional[Callable] = None
+        # Recent JPEG screenshots by frame id (see current_frame); callbacks get only the id
+        self._frames: "OrderedDict[int, bytes]" = OrderedDict()
+        self._frame_id = 0
+        self._pending_shot: Optional[asyncio.Future] = None
+        # The newest frame is reused until the page changes (or it gets too old);
+        # debounced background captures only run while a stream is watching
+        self._frame_dirty = True
+        self._frame_taken_at = 0.0
+        self._frame_watchers = 0
+        self.on_screenshot_callback: Optional[Callable] = None  # async (provider, frame_id)
         self.on_url_change_callback: Optional[Callable] = None
         self.on_title_change_callback: Optional[Callable] = None
         self.message_queue = []
         self.last_activity = None
         self.is_logged_in = False
-        self._dom_change_task = None
+        self._dom_change_task: Optional[asyncio.Task] = None
+        # Navigation/title events are queued and handled by one consumer task
+        self._evt_q: Optional[asyncio.Queue] = None
+        self._evt_task: Optional[asyncio.Task] = None
+        self._context_proxy: Optional[Dict[str, Any]] = None  # proxy the context was opened with
+        self._last_dom_change = 0.0
         self._last_dom_hash = None
         self._auto_refresh_enabled = True
         self._last_url = None
         self._last_title = None
         self._navigation_history = []
         self._current_history_index = -1
+        # Selector chains, built once: the provider's known selector
+        # (fast path) ahead of the generic probes (slow path)
+        self._input_selectors = self._selector_chain(config.input_selector, CHAT_INPUT_SELECTORS)
+        self._response_selectors = self._selector_chain(config.response_selector, RESPONSE_SELECTORS)
+        self._new_chat_selectors = self._selector_chain(config.new_chat_selector, NEW_CHAT_SELECTORS)
+    
+    @staticmethod
+    def _selector_chain(preferred: Optional[str], generic: List[str]) -> List[str]:
+        if not preferred:
+            return list(generic)
+        return [preferred] + [s for s in generic if s != preferred]
         
-    async def initialize(self, headless: bool = True, proxy: Optional[Any] = None):
+    async def initialize(self, proxy: Optional[Any] = None):
         """Initialize the browser with maximum stealth."""
         if self.is_initialized:
             return
             
+        self._manager.unpark(self.provider)
+        proxy_settings = proxy.to_playwright_format() if proxy else None
         try:
-            logger.info(f"🚀 Portal [{self.provider.value}]: Launching stealth browser...")
-            if proxy:
-                logger.info(f"Using proxy: {proxy}")
-            
-            self.playwright = await async_playwright().start()
-            
-            # Maximum stealth args with audio support
-            args = [
-                "--disable-blink-features=AutomationControlled",
-                "--disable-features=IsolateOrigins,site-per-process",
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-                "--disable-web-security",
-                "--disable-features=site-isolation",
-                "--disable-features=IsolateOrigins",
-                f"--window-size={self.config.viewport['width']},{self.config.viewport['height']}",
-                "--force-color-profile=srgb",
-                "--disable-extensions-except=",
-                "--disable-component-extensions-with-background-pages",
-                "--disable-background-networking",
-                "--disable-sync",
-                "--disable-default-apps",
-                "--no-first-run",
-                "--no-default-browser-check",
-                "--password-store=basic",
-                "--use-mock-keychain",
-                # Audio support
-                "--autoplay-policy=no-user-gesture-required",
-                "--use-fake-ui-for-media-stream",
-                "--use-fake-device-for-media-stream",
-                "--enable-features=AudioServiceOutOfProcess",
-                "--disable-features=AudioServiceSandbox",
-            ]
-            
-            # Build browser launch options
-            launch_options = {
-                "headless": headless,
-                "args": args,
-            }
-            
-            # Add proxy if provided
-            if proxy:
-                launch_options["proxy"] = proxy.to_playwright_format()
+            # A parked (soft-closed) context is reused unless the proxy
+            # changed or the shared browser went away under it
+            if self.context is not None and (
+                proxy_settings != self._context_proxy
+                or not (self.browser and self.browser.is_connected())
+            ):
+                await self._close_context()
             
-            self.browser = await self.playwright.chromium.launch(**launch_options)
-            
-            # Use a real Chrome user agent with audio permissions
-            self.context = await self.browser.new_context(
-                viewport=self.config.viewport,
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-                locale="en-US",
-                timezone_id="America/New_York",
-                color_scheme="light",
-                geolocation={"latitude": 40.7128, "longitude": -74.0060},
-                permissions=["geolocation", "microphone", "camera"],
-                java_script_enabled=True,
-                has_touch=False,
-                is_mobile=False,
-                device_scale_factor=1,
-            )
-            
-            # Maximum stealth scripts
-            await self.context.add_init_script("""
-                // Hide automation
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, '__proto__', {webdriver: undefined});
-                
-                // Fake plugins
-                Object.defineProperty(navigator, 'plugins', {
-                    get: function() {
-                        return [
-                            {name: "Chrome PDF Plugin", filename: "internal-pdf-viewer", description: "Portable Document Format"},
-                            {name: "Chrome PDF Viewer", filename: "mhjfbmdgcfjbbpaeojofohoefgiehjai", description: ""},
-                            {name: "Native Client", filename: "internal-nacl-plugin", description: ""},
-                            {name: "Widevine Content Decryption Module", filename: "widevinecdmadapter.dll", description: "Widevine Content Decryption Module"}
-                        ];
-                    }
-                });
-                
-                // Fake languages
-                Object.defineProperty(navigator, 'languages', {
-                    get: function() { return ['en-US', 'en']; }
-                });
-                
-                // Fake Chrome
-                window.chrome = {
-                    runtime: {
-                        OnInstalledReason: {CHROME_UPDATE: "chrome_update", INSTALL: "install", SHARED_MODULE_UPDATE: "shared_module_update", UPDATE: "update"},
-                        OnRestartRequiredReason: {APP_UPDATE: "app_update", OS_UPDATE: "os_update", PERIODIC: "periodic"},
-                        PlatformArch: {ARM: "arm", ARM64: "arm64", MIPS: "mips", MIPS64: "mips64", MIPS64EL: "mips64el", MIPSEL: "mipsel", X86_32: "x86-32", X86_64: "x86-64"},
-                        PlatformNaclArch: {ARM: "arm", MIPS: "mips", MIPS64: "mips64", MIPS64EL: "mips64el", MIPSEL: "mipsel", MIPSEL64: "mipsel64", X86_32: "x86-32", X86_64: "x86-64"},
-                        PlatformOs: {ANDROID: "android", CROS: "cros", LINUX: "linux", MAC: "mac", OPENBSD: "openbsd", WIN: "win"},
-                        RequestUpdateCheckStatus: {NO_UPDATE: "no_update", THROTTLED: "throttled", UPDATE_AVAILABLE: "update_available"}
-                    },
-                    csi: function() {},
-                    loadTimes: function() {}
-                };
-                
-                // Fake notification permissions
-                if (!window.Notification) {
-                    window.Notification = {
-                        permission: "default",
-                        requestPermission: async function() { return "default"; }
-                    };
-                }
-                
-                // Override permissions API
-                const originalQuery = window.navigator.permissions.query;
-                window.navigator.permissions.query = (parameters) => (
-                    parameters.name === 'notifications' 
-                        ? Promise.resolve({ state: Notification.permission })
-                        : originalQuery(parameters)
-                );
-                
-                // Hide Playwright/Automation
-                delete navigator.__proto__.webdriver;
-                
-                // Canvas noise
-                const getImageData = CanvasRenderingContext2D.prototype.getImageData;
-                CanvasRenderingContext2D.prototype.getImageData = function(x, y, w, h) {
-                    const imageData = getImageData.call(this, x, y, w, h);
-                    const data = imageData.data;
-                    for (let i = 0; i < data.length; i += 4) {
-                        data[i] = data[i] + 1;
-                    }
-                    return imageData;
-                };
-                
-                // WebGL noise
-                const getParameter = WebGLRenderingContext.prototype.getParameter;
-                WebGLRenderingContext.prototype.getParameter = function(parameter) {
-                    if (parameter === 37445) {
-                        return 'Intel Inc.';
-                    }
-                    if (parameter === 37446) {
-                        return 'Intel Iris OpenGL Engine';
-                    }
-                    return getParameter.call(this, parameter);
-                };
-                
-                // Audio Context support for audio captchas
-                if (window.AudioContext || window.webkitAudioContext) {
-                    const OriginalAudioContext = window.AudioContext || window.webkitAudioContext;
-                    window.AudioContext = function() {
-                        const instance = new OriginalAudioContext();
-                        // Ensure destination is properly connected
-                        if (instance.destination) {
-                            Object.defineProperty(instance.destination, 'maxChannelCount', {
-                                get: () => 2
-                            });
-                        }
-                        return instance;
-                    };
-                    window.AudioContext.prototype = OriginalAudioContext.prototype;
-                    if (window.webkitAudioContext) {
-                        window.webkitAudioContext = window.AudioContext;
-                    }
-                }
-                
-                // Allow audio autoplay
-                const originalAudioPlay = HTMLMediaElement.prototype.play;
-                HTMLMediaElement.prototype.play = function() {
-                    this.muted = false;
-                    return originalAudioPlay.apply(this, arguments);
-                };
-            """)
+            if self.context is None:
+                logger.info(f"🚀 Portal [{self.provider.value}]: Opening stealth browser context...")
+                if proxy:
+                    logger.info(f"Using proxy: {proxy}")
+                await self._open_context(proxy_settings)
+            else:
+                logger.info(f"♻️ Portal [{self.provider.value}]: Reusing warm browser context")
             
             self.page = await self.context.new_page()
             
-            # Monitor navigation
-            self.page.on("framenavigated", lambda frame: asyncio.create_task(self._on_navigation(frame)))
-            self.page.on("title", lambda: asyncio.create_task(self._on_title_change()))
+            # Hot paths (screenshots, typing) go straight to CDP; Playwright's API is the fallback
+            try:
+                self._cdp = await self.context.new_cdp_session(self.page)
+            except Exception as e:
+                logger.warning(f"Portal [{self.provider.value}]: no CDP session, using Playwright API: {e}")
+                self._cdp = None
+            
+            # Monitor navigation (one consumer task instead of a task per event)
+            self._evt_q = asyncio.Queue()
+            self._evt_task = asyncio.create_task(self._consume_page_events())
+            self.page.on("framenavigated", self._on_frame_navigated)
+            self.page.on("title", lambda: self._evt_q.put_nowait(("title",)))
             
             # Navigate to initial URL
             logger.info(f"Portal [{self.provider.value}]: Navigating to {self.config.url}")
             await self.goto_url(self.config.url)
             
             # Handle login if required
-            if self.config.requires_login and self.config.credentials:
+            if self.config.requires_login and self.config.credentials and not self.is_logged_in:
                 await self._perform_login()
             
             self.is_initialized = True
             logger.info(f"✅ Portal [{self.provider.value}]: Browser ready!")
             
-            await self.take_screenshot()
-            
         except Exception as e:
             logger.error(f"Failed to initialize portal [{self.provider.value}]: {e}")
             raise
     
-    async def _on_navigation(self, frame):
-        """Handle navigation events."""
-        if frame == self.page.main_frame:
-            url = frame.url
-            if url != self._last_url:
-                self._last_url = url
-                logger.info(f"Portal [{self.provider.value}]: Navigated to {url}")
-                if self.on_url_change_callback:
-                    await self.on_url_change_callback(self.provider.value, url)
-                await self.take_screenshot()
+    async def _open_context(self, proxy_settings: Optional[Dict[str, Any]]):
+        """Create this portal's stealth context on the shared browser."""
+        # One shared Chromium for every portal; each portal gets its own context
+        self.browser = await self._manager.ensure_browser()
+        
+        # Use a real Chrome user agent with audio permissions
+        self.context = await self.browser.new_context(
+            viewport=self.config.viewport,
+            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+            locale="en-US",
+            timezone_id="America/New_York",
+            color_scheme="light",
+            geolocation={"latitude": 40.7128, "longitude": -74.0060},
+            permissions=["geolocation", "microphone", "camera"],
+            java_script_enabled=True,
+            has_touch=False,
+            is_mobile=False,
+            device_scale_factor=1,
+            proxy=proxy_settings,
+        )
+        
+        # Maximum stealth scripts
+        await self.context.add_init_script(STEALTH_JS)
+        
+        # Debounced DOM change notices drive screenshots (see DOM_CHANGE_SCRIPT)
+        await self.context.expose_function("__changeSink", self._on_dom_change)
+        await self.context.add_init_script(DOM_CHANGE_SCRIPT)
+        self._context_proxy = proxy_settings
+    
+    async def _close_context(self):
+        """Dispose of this portal's context (cookies, logins and all)."""
+        context, self.context = self.context, None
+        self.page = None
+        self._cdp = None
+        self.is_logged_in = False
+        if context:
+            try:
+                await context.close()
+            except Exception as e:
+                logger.warning(f"Portal [{self.provider.value}]: context close error: {e}")
+    
+    def _on_frame_navigated(self, frame):
+        """Queue main-frame navigations for the event consumer."""
+        if self.page and frame == self.page.main_frame:
+            self._evt_q.put_nowait(("nav", frame.url))
+    
+    async def _consume_page_events(self):
+        """Drain queued navigation/title events, coalescing bursts."""
+        while True:
+            try:
+                events = [await self._evt_q.get()]
+                while not self._evt_q.empty():
+                    events.append(self._evt_q.get_nowait())
+                
+                # Drop a nav event when the next one is for the same URL, and
+                # handle at most one title refresh per burst
+                title_pending = False
+                for i, event in enumerate(events):
+                    if event[0] == "title":
+                        title_pending = True
+                    elif i + 1 < len(events) and events[i + 1] == event:
+                        continue
+                    else:
+                        try:
+                            await self._on_navigation(event[1])
+                        except Exception as e:
+                            logger.error(f"Navigation event error: {e}")
+                if title_pending:
+                    await self._on_title_change()
+            except Exception as e:
+                # One bad event must not kill the consumer for the portal's lifetime
+                logger.error(f"Page event error: {e}")
+    
+    async def _on_navigation(self, url: str):
+        """Handle a main-frame navigation."""
+        if url != self._last_url:
+            self._last_url = url
+            logger.info(f"Portal [{self.provider.value}]: Navigated to {url}")
+            if self.on_url_change_callback:
+                await self.on_url_change_callback(self.provider.value, url)
+    
+    async def _on_dom_change(self, count: int = 0):
+        """Sink for the page's batched DOM change notices."""
+        self._last_dom_change = asyncio.get_running_loop().time()
+        self._mark_frame_dirty()
+    
+    def _mark_frame_dirty(self):
+        """The page changed: the cached frame is stale. Recapture (debounced) if anyone is watching."""
+        self._frame_dirty = True
+        if self._frame_watchers and (self._dom_change_task is None or self._dom_change_task.done()):
+            self._dom_change_task = asyncio.create_task(self._debounced_screenshot())
+    
+    def watch_frames(self):
+        """Register a live frame consumer (keeps the frame cache fresh in the background)."""
+        self._frame_watchers += 1
+    
+    def unwatch_frames(self):
+        self._frame_watchers = max(0, self._frame_watchers - 1)
+    
+    async def current_frame(self) -> Optional[Tuple[int, bytes]]:
+        """
+        (frame_id, JPEG bytes) of the page as it is now. Reuses the newest
+        cached frame unless the page changed since, or it is older than
+        FRAME_MAX_AGE (canvas/video/hover changes never reach the observer).
+        """
+        if not self.page:
+            return None
+        age = asyncio.get_running_loop().time() - self._frame_taken_at
+        if self._frame_dirty or not self._frames or age > FRAME_MAX_AGE:
+            await self.take_screenshot()
+        frame_id = self.latest_frame_id
+        if frame_id is None:
+            return None
+        return frame_id, self._frames[frame_id]
+    
+    async def _debounced_screenshot(self):
+        """Take a screenshot once the DOM settles (or DOM_SETTLE_MAX_WAIT passes)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DOM_SETTLE_MAX_WAIT
+        while True:
+            wait = min(self._last_dom_change + DOM_SETTLE_DELAY, deadline) - loop.time()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self.take_screenshot()
+    
+    async def _wait_for_dom_quiet(self, quiet: float = NAV_QUIET_WINDOW, timeout: float = NAV_QUIET_TIMEOUT):
+        """Wait until no DOM changes have been reported for `quiet` seconds (at most `timeout`)."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + timeout
+        while True:
+            quiet_at = max(self._last_dom_change, start) + quiet
+            wait = min(quiet_at, deadline) - loop.time()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
     
     async def _on_title_change(self):
         """Handle title change events."""
@@ -339,10 +540,9 @@ class BrowserPortal:
         if not self.page:
             return False
         try:
-            await self.page.goto(url, timeout=60000, wait_until="networkidle")
+            await self.page.goto(url, timeout=30000, wait_until="domcontentloaded")
             self._last_url = url
-            await asyncio.sleep(2)
-            await self.take_screenshot()
+            await self._wait_for_dom_quiet()
             return True
         except Exception as e:
             logger.error(f"Failed to navigate to {url}: {e}")
@@ -353,9 +553,8 @@ class BrowserPortal:
         if not self.page:
             return False
         try:
-            await self.page.go_back(timeout=10000)
-            await asyncio.sleep(1)
-            await self.take_screenshot()
+            await self.page.go_back(timeout=10000, wait_until="domcontentloaded")
+            await self._wait_for_dom_quiet()
             return True
         except Exception as e:
             logger.warning(f"Go back failed: {e}")
@@ -366,9 +565,8 @@ class BrowserPortal:
         if not self.page:
             return False
         try:
-            await self.page.go_forward(timeout=10000)
-            await asyncio.sleep(1)
-            await self.take_screenshot()
+            await self.page.go_forward(timeout=10000, wait_until="domcontentloaded")
+            await self._wait_for_dom_quiet()
             return True
         except Exception as e:
             logger.warning(f"Go forward failed: {e}")
@@ -405,23 +603,12 @@ class BrowserPortal:
             # Wait for login form
             await self.page.wait_for_selector('input[type="email"], input[name="username"], input[type="text"]', timeout=10000)
             
-            # Fill username
-            username_selectors = ['input[type="email"]', 'input[name="username"]', 'input[type="text"]']
-            for selector in username_selectors:
-                try:
-                    await self.page.fill(selector, creds.username)
-                    break
-                except:
-                    continue
-            
-            # Fill password
-            await self.page.fill('input[type="password"]', creds.password)
+            # Find, fill and submit the form in one round-trip
+            if not await self.page.evaluate(LOGIN_SCRIPT, {"u": creds.username, "p": creds.password}):
+                raise RuntimeError("login form fields not found")
             
-            # Click login
-            await self.page.click('button[type="submit"], input[type="submit"]')
-            
-            # Wait for navigation
-            await asyncio.sleep(5)
+            # Wait for the post-login page to settle (at most the old fixed 5s)
+            await self._wait_for_dom_quiet(timeout=LOGIN_SETTLE_TIMEOUT)
             
             self.is_logged_in = True
             logger.info(f"✅ Portal [{self.provider.value}]: Login successful")
@@ -429,18 +616,90 @@ class BrowserPortal:
         except Exception as e:
             logger.warning(f"Login failed for [{self.provider.value}]: {e}")
     
-    async def take_screenshot(self) -> str:
-        """Take a screenshot."""
+    async def take_screenshot(self) -> Optional[int]:
+        """
+        Take a JPEG screenshot into the frame cache and notify
+        on_screenshot_callback with (provider, frame_id). Returns the
+        frame id, or None on failure.
+        
+        Single-flight: callers arriving while a capture is in progress
+        share its result instead of starting another.
+        """
         if not self.page:
-            return ""
+            return None
+        if self._pending_shot is not None:
+            return await asyncio.shield(self._pending_shot)
+        
+        self._pending_shot = asyncio.get_running_loop().create_future()
+        try:
+            frame_id = await self._capture_screenshot()
+            self._pending_shot.set_result(frame_id)
+            return frame_id
+        finally:
+            if not self._pending_shot.done():
+                self._pending_shot.set_result(None)
+            self._pending_shot = None
+    
+    async def _capture_screenshot(self) -> Optional[int]:
+        """Capture, cache and announce one screenshot (see take_screenshot)."""
         try:
-            await self.page.screenshot(path=self.screenshot_path, full_page=False)
+            # Changes from here on belong to the next frame
+            self._frame_dirty = False
+            self._frame_taken_at = asyncio.get_running_loop().time()
+            data = await self._screenshot()
+            self._frame_id += 1
+            frame_id = self._frame_id
+            self._frames[frame_id] = data
+            if len(self._frames) > FRAME_CACHE_SIZE:
+                self._frames.popitem(last=False)
             if self.on_screenshot_callback:
-                await self.on_screenshot_callback(self.provider.value, self.screenshot_path)
-            return self.screenshot_path
+                await self.on_screenshot_callback(self.provider.value, frame_id)
+            return frame_id
         except Exception as e:
+            self._frame_dirty = True
             logger.error(f"Screenshot failed: {e}")
-            return ""
+            return None
+    
+    async def _screenshot(self, fmt: str = "jpeg", quality: Optional[int] = SCREENSHOT_JPEG_QUALITY) -> bytes:
+        """Viewport screenshot, via CDP when available (skips Playwright's marshaling)."""
+        # Only JPEG takes a quality
+        if fmt != "jpeg":
+            quality = None
+        if self._cdp:
+            try:
+                params = {"format": fmt}
+                if quality is not None:
+                    params["quality"] = quality
+                result = await self._cdp.send("Page.captureScreenshot", params)
+                return base64.b64decode(result["data"])
+            except Exception as e:
+                logger.debug(f"CDP screenshot failed, falling back: {e}")
+        return await self.page.screenshot(type=fmt, quality=quality, full_page=False)
+    
+    async def _insert_text(self, text: str):
+        """Insert text at the focused element: one CDP call instead of a keystroke per character."""
+        if self._cdp:
+            try:
+                await self._cdp.send("Input.insertText", {"text": text})
+                return
+            except Exception as e:
+                logger.debug(f"CDP insertText failed, falling back: {e}")
+        await self.page.keyboard.type(text, delay=10)
+    
+    @property
+    def latest_frame_id(self) -> Optional[int]:
+        """Id of the newest cached screenshot, if any."""
+        return next(reversed(self._frames), None)
+    
+    async def take_screenshot_bytes(self, type: str = "png", quality: Optional[int] = None) -> bytes:
+        """Take a screenshot straight to memory (no /tmp round-trip)."""
+        if not self.page:
+            return b""
+        try:
+            return await self._screenshot(type, quality)
+        except Exception as e:
+            logger.error(f"Screenshot failed: {e}")
+            return b""
     
     async def click(self, x: float, y: float):
         """Click at coordinates."""
@@ -448,8 +707,7 @@ class BrowserPortal:
             return
         try:
             await self.page.mouse.click(x, y)
-            await asyncio.sleep(0.5)
-            await self.take_screenshot()
+            self._mark_frame_dirty()
         except Exception as e:
             logger.error(f"Click error: {e}")
     
@@ -458,9 +716,8 @@ class BrowserPortal:
         if not self.page:
             return
         try:
-            await self.page.keyboard.type(text, delay=10)
-            await asyncio.sleep(0.3)
-            await self.take_screenshot()
+            await self._insert_text(text)
+            self._mark_frame_dirty()
         except Exception as e:
             logger.error(f"Type error: {e}")
     
@@ -470,8 +727,7 @@ class BrowserPortal:
             return
         try:
             await self.page.keyboard.press(key)
-            await asyncio.sleep(0.3)
-            await self.take_screenshot()
+            self._mark_frame_dirty()
         except Exception as e:
             logger.error(f"Key press error: {e}")
     
@@ -481,8 +737,7 @@ class BrowserPortal:
             return
         try:
             await self.page.mouse.wheel(delta_x, delta_y)
-            await asyncio.sleep(0.3)
-            await self.take_screenshot()
+            self._mark_frame_dirty()
         except Exception as e:
             logger.error(f"Scroll error: {e}")
     
@@ -491,59 +746,27 @@ class BrowserPortal:
         if not self.page:
             return "Error: Browser not initialized"
         try:
-            input_selectors = [
-                'textarea',
-                'div[contenteditable="true"]',
-                '[data-testid="chat-input"]',
-                '[role="textbox"]',
-                'input[type="text"]',
-            ]
-            
-            for selector in input_selectors:
-                try:
-                    el = await self.page.wait_for_selector(selector, timeout=3000)
-                    if el:
-                        await el.click()
-                        await self.page.keyboard.type(message, delay=10)
-                        await asyncio.sleep(0.3)
-                        await self.page.keyboard.press("Enter")
-                        break
-                except:
-                    continue
+            # One polled DOM query over all candidates instead of a 3s wait per selector
+            try:
+                await self.page.wait_for_function(FOCUS_INPUT_SCRIPT, arg=self._input_selectors, timeout=3000)
+            except Exception:
+                return "Error: Chat input not found"
             
-            await asyncio.sleep(2)
-            await self.take_screenshot()
+            await self._insert_text(message)
+            await self.page.keyboard.press("Enter")
             
+            # Let the reply render (same 2s budget the fixed sleep had, but returns once the DOM is quiet)
+            await self._wait_for_dom_quiet(timeout=SEND_SETTLE_TIMEOUT)
             response = await self._extract_response()
             return response or "Message sent"
             
         except Exception as e:
-            await self.take_screenshot()
             return f"Error: {str(e)}"
     
     async def _extract_response(self) -> str:
         """Extract latest response."""
         try:
-            return await self.page.evaluate("""
-                () => {
-                    const selectors = [
-                        '[data-message-author-role="assistant"]',
-                        '.message-content',
-                        '.ac-textBlock',
-                        '[class*="response"]',
-                        'article',
-                    ];
-                    for (const sel of selectors) {
-                        const els = document.querySelectorAll(sel);
-                        if (els.length > 0) {
-                            const last = els[els.length - 1];
-                            const text = last.innerText || last.textContent || '';
-                            if (text.trim().length > 10) return text.trim();
-                        }
-                    }
-                    return '';
-                }
-            """)
+            return await self.page.evaluate(EXTRACT_RESPONSE_SCRIPT, self._response_selectors)
         except:
             return ""
     
@@ -552,18 +775,12 @@ class BrowserPortal:
         if not self.page:
             return
         try:
-            selectors = [
-                'button:has-text("New chat")',
-                'button:has-text("New Chat")',
-                '[aria-label*="new chat" i]',
-            ]
-            for sel in selectors:
+            for sel in self._new_chat_selectors:
                 try:
                     btn = await self.page.query_selector(sel)
                     if btn:
                         await btn.click()
-                        await asyncio.sleep(1)
-                        await self.take_screenshot()
+                        await self._wait_for_dom_quiet()
                         return
                 except:
                     continue
@@ -576,21 +793,36 @@ class BrowserPortal:
         if not self.page:
             return
         try:
-            await self.page.reload()
-            await asyncio.sleep(3)
-            await self.take_screenshot()
+            await self.page.reload(wait_until="domcontentloaded")
+            await self._wait_for_dom_quiet()
         except Exception as e:
             logger.error(f"Refresh error: {e}")
     
-    async def close(self):
-        """Close the browser."""
+    async def close(self, soft: bool = False):
+        """
+        Close this portal (the shared browser keeps running). soft=True
+        closes only the page and parks the context, so the next
+        initialize() reuses it (and its logins) instead of starting cold.
+        """
         try:
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
+            if self._dom_change_task:
+                self._dom_change_task.cancel()
+                self._dom_change_task = None
+            if self._evt_task:
+                self._evt_task.cancel()
+                self._evt_task = None
             self.is_initialized = False
-            logger.info(f"Portal [{self.provider.value}]: Browser closed")
+            self._frames.clear()
+            self._frame_dirty = True
+            if soft and self.context:
+                page, self.page = self.page, None
+                self._cdp = None  # detached along with its page
+                if page:
+                    await page.close()
+                logger.info(f"Portal [{self.provider.value}]: Page closed, context parked")
+            else:
+                await self._close_context()
+                logger.info(f"Portal [{self.provider.value}]: Browser closed")
         except Exception as e:
             logger.error(f"Close error: {e}")
     
@@ -607,8 +839,26 @@ class BrowserPortal:
 class PortalManager:
     """Manages multiple browser portals."""
     
-    def __init__(self):
+    def __init__(self, headless: bool = True):
         self.portals: Dict[PortalProvider, BrowserPortal] = {}
+        # One setting for the shared Chromium (every portal runs in it)
+        self.headless = headless
+        self.playwright = None
+        self.browser: Optional[Browser] = None
+        self._browser_lock = asyncio.Lock()
+        # Soft-closed portals keep their context warm until idle for PORTAL_IDLE_TTL
+        self._last_used: Dict[PortalProvider, float] = {}
+        self._evict_task: Optional[asyncio.Task] = None
+    
+    async def ensure_browser(self) -> Browser:
+        """Launch the shared Chromium on first use (or after it died) and return it."""
+        async with self._browser_lock:
+            if self.browser is None or not self.browser.is_connected():
+                if self.playwright is None:
+                    self.playwright = await async_playwright().start()
+                logger.info("🚀 Launching shared stealth browser...")
+                self.browser = await self.playwright.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+            return self.browser
     
     def get_portal(self, provider: PortalProvider) -> BrowserPortal:
         """Get or create a portal for a provider."""
@@ -616,17 +866,61 @@ class PortalManager:
             config = PORTAL_CONFIGS.get(provider)
             if not config:
                 raise ValueError(f"Unknown provider: {provider}")
-            self.portals[provider] = BrowserPortal(provider, config)
+            self.portals[provider] = BrowserPortal(provider, config, self)
         return self.portals[provider]
     
+    async def release(self, provider: PortalProvider):
+        """Soft-close a portal, keeping its context warm for reuse."""
+        portal = self.portals.get(provider)
+        if portal is None:
+            return
+        await portal.close(soft=True)
+        if portal.context is None:
+            return
+        self._last_used[provider] = asyncio.get_running_loop().time()
+        if self._evict_task is None or self._evict_task.done():
+            self._evict_task = asyncio.create_task(self._evict_idle())
+    
+    def unpark(self, provider: PortalProvider):
+        """Take a portal off the eviction list (it is being reinitialized)."""
+        self._last_used.pop(provider, None)
+    
+    async def _evict_idle(self):
+        """Fully close parked portals once they have sat idle for PORTAL_IDLE_TTL."""
+        loop = asyncio.get_running_loop()
+        while self._last_used:
+            await asyncio.sleep(PORTAL_EVICT_INTERVAL)
+            now = loop.time()
+            for provider, last_used in list(self._last_used.items()):
+                portal = self.portals.get(provider)
+                if now - last_used < PORTAL_IDLE_TTL:
+                    continue
+                del self._last_used[provider]
+                if portal and not portal.is_initialized:
+                    logger.info(f"Portal [{provider.value}]: idle for {PORTAL_IDLE_TTL}s, closing context")
+                    await portal.close()
+    
     def get_active_portals(self) -> Dict[PortalProvider, BrowserPortal]:
         """Get all running portals."""
         return {k: v for k, v in self.portals.items() if v.is_running()}
     
     async def close_all(self):
-        """Close all portals."""
+        """Close all portals, then the shared browser."""
+        if self._evict_task:
+            self._evict_task.cancel()
+            self._evict_task = None
+        self._last_used.clear()
         for portal in self.portals.values():
             await portal.close()
+        try:
+            if self.browser:
+                await self.browser.close()
+            if self.playwright:
+                await self.playwright.stop()
+        except Exception as e:
+            logger.error(f"Browser close error: {e}")
+        self.browser = None
+        self.playwright = None
 
 
 _portal_manager = PortalManager()
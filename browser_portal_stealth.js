@@ -0,0 +1,107 @@
+// Stealth patches for portal browser contexts, installed by browser_portal.py
+// via add_init_script (loaded and minified once at import).
+
+// Hide automation
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+Object.defineProperty(navigator, '__proto__', {webdriver: undefined});
+
+// Fake plugins
+Object.defineProperty(navigator, 'plugins', {
+    get: function() {
+        return [
+            {name: "Chrome PDF Plugin", filename: "internal-pdf-viewer", description: "Portable Document Format"},
+            {name: "Chrome PDF Viewer", filename: "mhjfbmdgcfjbbpaeojofohoefgiehjai", description: ""},
+            {name: "Native Client", filename: "internal-nacl-plugin", description: ""},
+            {name: "Widevine Content Decryption Module", filename: "widevinecdmadapter.dll", description: "Widevine Content Decryption Module"}
+        ];
+    }
+});
+
+// Fake languages
+Object.defineProperty(navigator, 'languages', {
+    get: function() { return ['en-US', 'en']; }
+});
+
+// Fake Chrome
+window.chrome = {
+    runtime: {
+        OnInstalledReason: {CHROME_UPDATE: "chrome_update", INSTALL: "install", SHARED_MODULE_UPDATE: "shared_module_update", UPDATE: "update"},
+        OnRestartRequiredReason: {APP_UPDATE: "app_update", OS_UPDATE: "os_update", PERIODIC: "periodic"},
+        PlatformArch: {ARM: "arm", ARM64: "arm64", MIPS: "mips", MIPS64: "mips64", MIPS64EL: "mips64el", MIPSEL: "mipsel", X86_32: "x86-32", X86_64: "x86-64"},
+        PlatformNaclArch: {ARM: "arm", MIPS: "mips", MIPS64: "mips64", MIPS64EL: "mips64el", MIPSEL: "mipsel", MIPSEL64: "mipsel64", X86_32: "x86-32", X86_64: "x86-64"},
+        PlatformOs: {ANDROID: "android", CROS: "cros", LINUX: "linux", MAC: "mac", OPENBSD: "openbsd", WIN: "win"},
+        RequestUpdateCheckStatus: {NO_UPDATE: "no_update", THROTTLED: "throttled", UPDATE_AVAILABLE: "update_available"}
+    },
+    csi: function() {},
+    loadTimes: function() {}
+};
+
+// Fake notification permissions
+if (!window.Notification) {
+    window.Notification = {
+        permission: "default",
+        requestPermission: async function() { return "default"; }
+    };
+}
+
+// Override permissions API
+const originalQuery = window.navigator.permissions.query;
+window.navigator.permissions.query = (parameters) => (
+    parameters.name === 'notifications' 
+        ? Promise.resolve({ state: Notification.permission })
+        : originalQuery(parameters)
+);
+
+// Hide Playwright/Automation
+delete navigator.__proto__.webdriver;
+
+// Canvas noise
+const canvasNoise = 1 + ((Math.random() * 255) | 0);  // 1..255, never a no-op
+const getImageData = CanvasRenderingContext2D.prototype.getImageData;
+CanvasRenderingContext2D.prototype.getImageData = function(x, y, w, h) {
+    const imageData = getImageData.call(this, x, y, w, h);
+    // Flip the first two pixels' red channel by a fixed per-document offset:
+    // enough to change the fingerprint hash, O(1) however large the read
+    const data = imageData.data;
+    if (data.length > 0) data[0] ^= canvasNoise;
+    if (data.length > 4) data[4] ^= canvasNoise;
+    return imageData;
+};
+
+// WebGL noise
+const getParameter = WebGLRenderingContext.prototype.getParameter;
+WebGLRenderingContext.prototype.getParameter = function(parameter) {
+    if (parameter === 37445) {
+        return 'Intel Inc.';
+    }
+    if (parameter === 37446) {
+        return 'Intel Iris OpenGL Engine';
+    }
+    return getParameter.call(this, parameter);
+};
+
+// Audio Context support for audio captchas
+if (window.AudioContext || window.webkitAudioContext) {
+    const OriginalAudioContext = window.AudioContext || window.webkitAudioContext;
+    window.AudioContext = function() {
+        const instance = new OriginalAudioContext();
+        // Ensure destination is properly connected
+        if (instance.destination) {
+            Object.defineProperty(instance.destination, 'maxChannelCount', {
+                get: () => 2
+            });
+        }
+        return instance;
+    };
+    window.AudioContext.prototype = OriginalAudioContext.prototype;
+    if (window.webkitAudioContext) {
+        window.webkitAudioContext = window.AudioContext;
+    }
+}
+
+// Allow audio autoplay
+const originalAudioPlay = HTMLMediaElement.prototype.play;
+HTMLMediaElement.prototype.play = function() {
+    this.muted = false;
+    return originalAudioPlay.apply(this, arguments);
+};
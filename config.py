@@ -59,6 +59,11 @@ CORS_ORIGINS = ["*"]
 CORS_METHODS = ["*"]
 CORS_HEADERS = ["*"]
 
+# Reverse proxies in front of the app that append to X-Forwarded-For
+# (HF Spaces runs one). Rate limits key on the client address that many
+# hops from the right of the header; 0 = use the socket peer.
+TRUSTED_PROXY_HOPS = 1
+
 # API metadata
 API_TITLE = "K-AI API"
 API_DESCRIPTION = "Free AI proxy API. No signup, no API keys. Feel free to AI."
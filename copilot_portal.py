@@ -171,16 +171,16 @@ class CopilotPortal:
             logger.error(f"Failed to initialize portal: {e}")
             raise
     
-    async def take_screenshot(self) -> str:
-        """Take a screenshot of the current page state."""
+    async def take_screenshot(self) -> Optional[str]:
+        """Take a screenshot of the current page state. Returns its path, or None on failure."""
         if not self.page:
-            return ""
+            return None
         try:
             await self.page.screenshot(path=self.last_screenshot, full_page=False)
             return self.last_screenshot
         except Exception as e:
             logger.error(f"Screenshot failed: {e}")
-            return ""
+            return None
     
     async def get_page_content(self) -> str:
         """Get current page HTML content for debugging."""
@@ -1,5 +1,20 @@
+"""
+Database Clients
+----------------
+Shared Supabase clients: a sync one (get_supabase) and a pooled async
+one (get_async_supabase) for FastAPI handlers.
+
+Hot kaiapi_api_keys lookups are index-backed (see the supabase_*.sql files):
+- token       UNIQUE  -> API auth (auth.verify_api_key)
+- token_hash  UNIQUE  -> /qaz/keys/lookup (supabase_api_keys_token_hash.sql)
+- created_at  DESC    -> /qaz/keys list ordering
+"""
+
+import asyncio
 import logging
-from supabase import create_client, Client
+from typing import Optional
+import httpx
+from supabase import create_client, acreate_client, Client, AsyncClient, AsyncClientOptions
 from config import SUPABASE_URL, SUPABASE_KEY
 
 logger = logging.getLogger("kai_api.db")
@@ -17,3 +32,51 @@ except Exception as e:
 
 def get_supabase() -> Client:
     return supabase
+
+
+# Shared async client — created once and reused so requests share its
+# connection pool instead of blocking the event loop on sync calls.
+_async_supabase: Optional[AsyncClient] = None
+_async_lock = asyncio.Lock()
+
+# HTTP/2 + keep-alive pool under the async client, so requests reuse
+# warm TLS connections to the Supabase edge
+HTTPX_TIMEOUT = 30
+HTTPX_LIMITS = httpx.Limits(max_connections=120, max_keepalive_connections=80, keepalive_expiry=30)
+_httpx_client: Optional[httpx.AsyncClient] = None
+
+async def get_async_supabase() -> Optional[AsyncClient]:
+    """Get the shared async Supabase client (None if unavailable)."""
+    global _async_supabase, _httpx_client
+    if _async_supabase is not None or not (SUPABASE_URL and SUPABASE_KEY):
+        return _async_supabase
+
+    async with _async_lock:
+        if _async_supabase is None:
+            try:
+                _httpx_client = httpx.AsyncClient(
+                    http2=True,
+                    timeout=HTTPX_TIMEOUT,
+                    limits=HTTPX_LIMITS,
+                    follow_redirects=True,
+                )
+                _async_supabase = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_KEY,
+                    options=AsyncClientOptions(httpx_client=_httpx_client),
+                )
+                logger.info("✅ Async Supabase client initialized")
+            except Exception as e:
+                logger.error(f"❌ Failed to initialize async Supabase: {e}")
+    return _async_supabase
+
+async def close_async_supabase():
+    """Close the shared async client's connections (on app shutdown)."""
+    global _async_supabase, _httpx_client
+    if _httpx_client is not None:
+        try:
+            await _httpx_client.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close async Supabase client: {e}")
+    _httpx_client = None
+    _async_supabase = None
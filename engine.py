@@ -13,7 +13,7 @@ The user doesn't care about wait time — reliability is everything.
 import logging
 import time
 import asyncio
-from supabase import create_client, Client
+from db import get_supabase
 from providers.base import BaseProvider
 from providers.g4f_provider import G4FProvider
 from providers.pollinations_provider import PollinationsProvider
@@ -22,7 +22,7 @@ from providers.zai_provider import ZaiProvider
 from providers.huggingface_widget_provider import HuggingFaceWidgetProvider
 from providers.copilot_provider import CopilotProvider
 from providers.opencode_provider import OpenCodeProvider
-from config import MODEL_RANKING, PROVIDER_MODELS, SUPABASE_URL, SUPABASE_KEY
+from config import MODEL_RANKING, PROVIDER_MODELS
 from models import ModelInfo
 from sanitizer import sanitize_response
 
@@ -74,10 +74,10 @@ class AIEngine:
         # Value = {success, failure, consecutive_failures, avg_time_ms, total_time_ms, count_samples}
         self._stats: dict[str, dict] = {}
         
-        # Connect to Supabase
+        # Connect to Supabase (shared process-wide client)
         self.supabase = None
         try:
-            self.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            self.supabase = get_supabase()
             self._load_stats()
         except Exception as e:
             logger.error(f"Supabase connection failed: {e}")
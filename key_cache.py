@@ -0,0 +1,150 @@
+"""
+API Key Cache
+-------------
+In-process TTL cache for rows of the kaiapi_api_keys table.
+Entries are keyed by a blake2b digest of the token so raw tokens
+are never kept in memory, and can be invalidated by key id when
+a key is revoked or its usage is reset. With a negative_ttl, unknown
+tokens are remembered too (as None) for a shorter period.
+
+TokenLoader coalesces concurrent cache misses into one IN (...) query.
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Defaults
+DEFAULT_TTL = 10  # seconds; short so dashboard usage counts stay fresh
+DEFAULT_MAXSIZE = 10_000
+
+
+def hash_token(token: str) -> bytes:
+    """Return the cache key for a token."""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class KeyCache:
+    """TTL cache of API key rows, keyed by token hash."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, maxsize: int = DEFAULT_MAXSIZE, negative_ttl: float = 0):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        # token hash -> (expires_at, row); row is None for a cached "no such key"
+        self._entries: Dict[bytes, Tuple[float, Optional[dict]]] = {}
+        # key id -> token hash (for invalidation on mutation)
+        self._ids: Dict[str, bytes] = {}
+
+    def get(self, token: str, default: Any = None) -> Any:
+        """Get a cached row for a token (None if known-missing), or default on miss/expiry."""
+        h = hash_token(token)
+        entry = self._entries.get(h)
+        if entry is None:
+            return default
+        expires_at, row = entry
+        if time.monotonic() >= expires_at:
+            self._drop(h)
+            return default
+        return row
+
+    def set(self, token: str, row: Optional[dict]):
+        """Cache a row for a token; None records a miss if negative_ttl is set."""
+        ttl = self.ttl if row is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        if len(self._entries) >= self.maxsize:
+            self._evict()
+        h = hash_token(token)
+        self._drop(h)
+        self._entries[h] = (time.monotonic() + ttl, row)
+        if row is None:
+            return
+        key_id = row.get("id")
+        if key_id is not None:
+            self._ids[str(key_id)] = h
+
+    def invalidate_id(self, key_id):
+        """Drop the cached row for a key id (after revoke/reset)."""
+        h = self._ids.pop(str(key_id), None)
+        if h is not None:
+            self._entries.pop(h, None)
+
+    def clear(self):
+        """Drop all cached rows."""
+        self._entries.clear()
+        self._ids.clear()
+
+    def _drop(self, h: bytes):
+        """Remove one entry and its reverse mapping."""
+        _, row = self._entries.pop(h, (None, None))
+        key_id = row.get("id") if row else None
+        if key_id is not None and self._ids.get(str(key_id)) == h:
+            del self._ids[str(key_id)]
+
+    def _evict(self):
+        """Remove expired entries, or the oldest one if none have expired."""
+        now = time.monotonic()
+        expired = [h for h, (exp, _) in self._entries.items() if exp <= now]
+        if not expired:
+            # Dicts keep insertion order, so the first key is the oldest
+            expired = [next(iter(self._entries))]
+        for h in expired:
+            self._drop(h)
+
+
+class TokenLoader:
+    """
+    DataLoader-style batcher for token lookups.
+    Concurrent load() calls within `delay` seconds are coalesced into a
+    single fetch_many(tokens) query, which returns {token: row}; each
+    caller gets its own row (or None).
+    """
+
+    def __init__(self, fetch_many: Callable[[List[str]], Awaitable[Dict[str, dict]]], delay: float = 0.005):
+        self._fetch_many = fetch_many
+        self._delay = delay
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def load(self, token: str) -> Optional[dict]:
+        """Queue a token for the next batch and wait for its row."""
+        fut = self._pending.get(token)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[token] = fut
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush())
+        # Shield so one cancelled caller doesn't cancel the shared future
+        return await asyncio.shield(fut)
+
+    async def _flush(self):
+        """Wait for the batch window, then resolve every pending token with one query."""
+        await asyncio.sleep(self._delay)
+        batch, self._pending = self._pending, {}
+        self._flush_task = None
+
+        try:
+            rows = await self._fetch_many(list(batch))
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for token, fut in batch.items():
+            if not fut.done():
+                fut.set_result(rows.get(token))
+
+
+# Global instance
+_key_cache: Optional[KeyCache] = None
+
+def get_key_cache() -> KeyCache:
+    """Get the global API key cache."""
+    global _key_cache
+    if _key_cache is None:
+        _key_cache = KeyCache()
+    return _key_cache
+
@@ -20,9 +20,10 @@ if os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
     os.environ["HOME"] = "/tmp"
 
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
@@ -53,7 +54,7 @@ from models import (
 )
 from services import engine, search_engine
 from v1_router import router as v1_router
-from admin_router import router as admin_router
+from admin_router import router as admin_router, startup as admin_startup, shutdown as admin_shutdown
 from tts_router import router as tts_router
 
 # ---------- Logging ----------
@@ -63,20 +64,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger("kai_api")
 
+# ---------- Lifecycle ----------
+from db import get_async_supabase, close_async_supabase
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared clients and start admin background work; tear them down on exit."""
+    await get_async_supabase()
+    await admin_startup()
+    try:
+        yield
+    finally:
+        await admin_shutdown()
+        await close_async_supabase()
+
+
 # ---------- App ----------
 app = FastAPI(
+    lifespan=lifespan,
     title=API_TITLE,
     description=API_DESCRIPTION,
     version=API_VERSION,
     docs_url=None,  # Disable default docs to serve custom one
     redoc_url=None,
+    default_response_class=ORJSONResponse,
 )
 
 # Mount static files (for CSS/JS if needed later)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Error Handling (Global)
-from error_handling import openai_error
+from error_handling import openai_error, error_server
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -95,6 +113,17 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         status_code=exc.status_code
     )
 
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """
+    Turn any uncaught exception into an OpenAI-style 500,
+    so routes don't need their own try/except boilerplate.
+    The detail is logged, never sent: /v1 clients are external.
+    """
+    logger.exception(f"Unhandled error on {request.url.path}: {exc}")
+    return error_server("Internal server error")
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,75 @@
+"""
+In-process Metrics
+------------------
+Cheap counters and latency histograms (auth key cache, proxy probes),
+served as JSON at /qaz/metrics so cache TTLs can be tuned from data.
+Per-process only; values reset on restart.
+"""
+
+import bisect
+from typing import Dict, Sequence, Union
+
+# Default latency buckets (milliseconds)
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class Histogram:
+    """Latency histogram with fixed upper-bound buckets (ms)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        """Record one observation, in milliseconds."""
+        self._counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def snapshot(self) -> dict:
+        le = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max, 2),
+            "buckets": dict(zip(le, self._counts)),
+        }
+
+
+_metrics: Dict[str, Union[Counter, Histogram]] = {}
+
+def counter(name: str) -> Counter:
+    """Get (or create) a named counter."""
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Counter()
+    return metric
+
+def histogram(name: str, buckets: Sequence[float] = DEFAULT_BUCKETS_MS) -> Histogram:
+    """Get (or create) a named latency histogram."""
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Histogram(buckets)
+    return metric
+
+def snapshot() -> dict:
+    """Current value of every metric, by name."""
+    return {name: metric.snapshot() for name, metric in sorted(_metrics.items())}
@@ -0,0 +1,99 @@
+"""
+MJPEG Frame Broadcaster
+-----------------------
+One capture -> encode pipeline per portal stream, shared by every viewer.
+Each frame is captured and encoded once and fanned out to all subscribers,
+so several open dashboards cost the same as one.
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+logger = logging.getLogger("kai_api.mjpeg_stream")
+
+
+class FrameBroadcaster:
+    """Runs the capture/encode pipeline while anyone is subscribed and fans frames out."""
+
+    def __init__(
+        self,
+        capture: Callable[[], Awaitable[bytes]],
+        encode: Optional[Callable[[bytes], bytes]],
+        is_running: Callable[[], bool],
+        frame_delay: float,
+    ):
+        self._capture = capture  # returns b"" when no frame is available
+        self._encode = encode    # CPU-bound, run in a worker thread; None = send as captured
+        self._is_running = is_running
+        self._frame_delay = frame_delay
+
+        self._latest: bytes = b""
+        self._seq = 0
+        self._done = False
+        self._cond = asyncio.Condition()
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        """Yield each new frame until the portal stops or the caller goes away."""
+        self._subscribers += 1
+        if self._task is None or self._task.done():
+            self._done = False
+            self._task = asyncio.create_task(self._run())
+
+        seen = self._seq
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: self._seq != seen or self._done)
+                    if self._seq == seen:
+                        return
+                    seen, frame = self._seq, self._latest
+                yield frame
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and self._task is not None:
+                self._task.cancel()
+                self._task = None
+
+    async def _run(self):
+        """Capture frame N+1 while frame N is being encoded, publishing each result."""
+        frames: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        def push(item):
+            # Drop the oldest frame rather than fall behind the live page
+            if frames.full():
+                frames.get_nowait()
+            frames.put_nowait(item)
+
+        async def capture():
+            while self._is_running():
+                raw = await self._capture()
+                if raw:
+                    push(raw)
+                await asyncio.sleep(self._frame_delay)
+            push(None)
+
+        capture_task = asyncio.create_task(capture())
+        try:
+            while (raw := await frames.get()) is not None:
+                try:
+                    frame = await asyncio.to_thread(self._encode, raw) if self._encode else raw
+                except Exception as e:
+                    logger.warning(f"Stream encode error: {e}")
+                    continue
+
+                async with self._cond:
+                    self._latest = frame
+                    self._seq += 1
+                    self._cond.notify_all()
+        finally:
+            capture_task.cancel()
+            async with self._cond:
+                self._done = True
+                self._cond.notify_all()
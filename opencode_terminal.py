@@ -14,11 +14,14 @@ import os
 import json
 import random
 import string
-from typing import Optional, Dict, Any, Callable
+import orjson
+from typing import Optional, Dict, Any, Callable, Set
 from dataclasses import dataclass
 from datetime import datetime
 import threading
 import queue
+from collections import deque
+from itertools import islice
 import shutil
 
 logger = logging.getLogger("kai_api.terminal_portal")
@@ -33,6 +36,13 @@ class TerminalConfig:
     config_path: str = ".opencode/config.json"
 
 
+def push_line(q: asyncio.Queue, item: Optional[tuple]):
+    """Queue an output item; a slow subscriber drops its oldest line rather than stall the others."""
+    if q.full():
+        q.get_nowait()
+    q.put_nowait(item)
+
+
 def generate_anonymous_identity():
     """Generate random device identifiers to appear as different device each time."""
     return {
@@ -74,11 +84,15 @@ class OpenCodeTerminalPortal:
     MAX_MESSAGES_BEFORE_RESET = 20  # Auto-reset after 20 messages
     AUTO_NEW_CHAT_BETWEEN_MESSAGES = True  # Start new chat between each message
     
+    OUTPUT_BUFFER_LINES = 5000  # Output lines kept for /terminal/output
+    
     def __init__(self, config: TerminalConfig):
         self.config = config
         self.process: Optional[subprocess.Popen] = None
         self.is_initialized = False
-        self.output_queue = queue.Queue()
+        # Recent (stream, line, json_frame) entries; deque appends are thread-safe
+        # and old lines fall off. Each line's JSON is encoded once, on arrival.
+        self.output_lines: deque = deque(maxlen=self.OUTPUT_BUFFER_LINES)
         self.input_queue = queue.Queue()
         self.output_thread: Optional[threading.Thread] = None
         self.on_output_callback: Optional[Callable] = None
@@ -88,6 +102,9 @@ class OpenCodeTerminalPortal:
         self.message_count = 0  # Track messages for auto-reset
         self.current_identity = None  # Track current session identity
         self.session_dir = None  # Track current session directory
+        # Live output listeners (e.g. /qaz/terminal/ws), fed from the reader thread
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Set[asyncio.Queue] = set()
         
     async def initialize(self):
         """Initialize OpenCode terminal session in ANONYMOUS/DISPOSABLE mode."""
@@ -220,7 +237,7 @@ class OpenCodeTerminalPortal:
                 # Read line from stdout
                 line = self.process.stdout.readline()
                 if line:
-                    self.output_queue.put(('stdout', line))
+                    self._emit('stdout', line)
                     if self.on_output_callback:
                         asyncio.create_task(self.on_output_callback('stdout', line))
                 
@@ -229,9 +246,39 @@ class OpenCodeTerminalPortal:
                 if self.process.stderr in select.select([self.process.stderr], [], [], 0)[0]:
                     err_line = self.process.stderr.readline()
                     if err_line:
-                        self.output_queue.put(('stderr', err_line))
+                        self._emit('stderr', err_line)
         except Exception as e:
             logger.error(f"Error reading output: {e}")
+        finally:
+            # The process is gone: tell live subscribers no more output is coming
+            if self._subscribers and self._loop is not None:
+                self._loop.call_soon_threadsafe(self._publish, None)
+    
+    def _emit(self, stream: str, line: str):
+        """Record an output line and push it to live subscribers (reader thread)."""
+        item = (stream, line, orjson.dumps({"type": stream, "content": line}))
+        self.output_lines.append(item)
+        if self._subscribers and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, item)
+    
+    def _publish(self, item: Optional[tuple]):
+        """Hand a line (None = end of output) to every subscriber queue (event loop)."""
+        for q in self._subscribers:
+            push_line(q, item)
+    
+    def subscribe(self, maxsize: int = 1000) -> asyncio.Queue:
+        """
+        Get a queue that receives each new (stream, line, json_frame) as it
+        is read, then None once the process exits.
+        """
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.add(q)
+        return q
+    
+    def unsubscribe(self, q: asyncio.Queue):
+        """Stop delivering output to a subscriber queue."""
+        self._subscribers.discard(q)
     
     async def send_input(self, text: str, is_message: bool = True):
         """Send text input to OpenCode with disposable mode handling."""
@@ -402,16 +449,10 @@ class OpenCodeTerminalPortal:
         # In production, you could use a terminal emulator that supports screenshots
         try:
             # Get recent output
-            output_lines = []
-            while not self.output_queue.empty() and len(output_lines) < 50:
-                try:
-                    stream, line = self.output_queue.get_nowait()
-                    output_lines.append(line)
-                except queue.Empty:
-                    break
+            output_lines = [line for _, line in self.get_output(max_lines=25)]
             
             # Create a simple text screenshot
-            screenshot_text = "\n".join(output_lines[-25:]) if output_lines else "Terminal ready..."
+            screenshot_text = "\n".join(output_lines) if output_lines else "Terminal ready..."
             
             # Save to file
             with open(self.screenshot_path, 'w') as f:
@@ -422,25 +463,20 @@ class OpenCodeTerminalPortal:
             logger.error(f"Screenshot failed: {e}")
             return ""
     
+    def _tail(self, max_lines: int) -> list:
+        """Copy the last max_lines buffer entries, oldest first."""
+        # Walk back from the newest line so only max_lines items are copied
+        entries = list(islice(reversed(self.output_lines), max(max_lines, 0)))
+        entries.reverse()
+        return entries
+    
     def get_output(self, max_lines: int = 100) -> list:
-        """Get recent output lines."""
-        lines = []
-        temp_queue = queue.Queue()
-        
-        # Get lines from queue without removing them permanently
-        while not self.output_queue.empty() and len(lines) < max_lines:
-            try:
-                item = self.output_queue.get_nowait()
-                lines.append(item)
-                temp_queue.put(item)
-            except queue.Empty:
-                break
-        
-        # Put them back
-        while not temp_queue.empty():
-            self.output_queue.put(temp_queue.get())
-        
-        return lines
+        """Get the most recent (stream, line) pairs, oldest first."""
+        return [(stream, line) for stream, line, _ in self._tail(max_lines)]
+    
+    def get_output_json(self, max_lines: int = 100) -> bytes:
+        """Get the most recent lines as a JSON array of {"type", "content"} objects."""
+        return b"[" + b",".join(frame for _, _, frame in self._tail(max_lines)) + b"]"
     
     def set_keyboard_active(self, active: bool):
         """Enable/disable keyboard input capture."""
@@ -15,9 +15,9 @@ import json
 import logging
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
-from supabase import create_client, Client
+from supabase import Client
 
-from config import SUPABASE_URL, SUPABASE_KEY
+from db import get_supabase
 
 logger = logging.getLogger("kai_api.provider_sessions")
 
@@ -42,12 +42,12 @@ class ProviderSessionManager:
     """Manages provider sessions via Supabase."""
     
     def __init__(self):
-        self.supabase: Optional[Client] = None
-        try:
-            self.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        # Reuse the process-wide client instead of opening another connection pool
+        self.supabase: Optional[Client] = get_supabase()
+        if self.supabase:
             logger.info("✅ ProviderSessionManager: Connected to Supabase")
-        except Exception as e:
-            logger.error(f"❌ ProviderSessionManager: Failed to connect to Supabase: {e}")
+        else:
+            logger.error("❌ ProviderSessionManager: Supabase unavailable")
     
     def is_available(self) -> bool:
         """Check if Supabase connection is available."""
@@ -7,7 +7,7 @@ Uses kaiapi_ prefixed table names for multi-project organization.
 
 import logging
 from typing import Dict, Optional
-from db import get_supabase
+from db import get_async_supabase
 from config import PROVIDERS
 
 logger = logging.getLogger("kai_api.provider_state")
@@ -27,12 +27,12 @@ class ProviderStateManager:
         if self._initialized:
             return
         
-        supabase = get_supabase()
+        supabase = await get_async_supabase()
         
         if supabase:
             try:
                 # Try to load from Supabase (using kaiapi_ prefixed table)
-                res = supabase.table(TABLE_NAME).select("*").execute()
+                res = await supabase.table(TABLE_NAME).select("*").execute()
                 
                 if res.data:
                     # Load existing states
@@ -51,7 +51,7 @@ class ProviderStateManager:
                     for provider_id, config in PROVIDERS.items():
                         if provider_id not in existing_ids:
                             try:
-                                supabase.table(TABLE_NAME).insert({
+                                await supabase.table(TABLE_NAME).insert({
                                     "provider_id": provider_id,
                                     "enabled": config["enabled"],
                                     "name": config["name"],
@@ -83,7 +83,7 @@ class ProviderStateManager:
             self._providers[provider_id] = config.copy()
             
             try:
-                supabase.table(TABLE_NAME).insert({
+                await supabase.table(TABLE_NAME).insert({
                     "provider_id": provider_id,
                     "enabled": config["enabled"],
                     "name": config["name"],
@@ -124,20 +124,20 @@ class ProviderStateManager:
         self._providers[provider_id]["enabled"] = enabled
         
         # Persist to Supabase
-        supabase = get_supabase()
+        supabase = await get_async_supabase()
         if supabase:
             try:
                 # Check if row exists
-                res = supabase.table(TABLE_NAME).select("id").eq("provider_id", provider_id).execute()
+                res = await supabase.table(TABLE_NAME).select("id").eq("provider_id", provider_id).execute()
                 
                 if res.data:
                     # Update existing
-                    supabase.table(TABLE_NAME).update({
+                    await supabase.table(TABLE_NAME).update({
                         "enabled": enabled
                     }).eq("provider_id", provider_id).execute()
                 else:
                     # Insert new
-                    supabase.table(TABLE_NAME).insert({
+                    await supabase.table(TABLE_NAME).insert({
                         "provider_id": provider_id,
                         "enabled": enabled,
                         "name": self._providers[provider_id]["name"],
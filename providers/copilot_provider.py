@@ -30,6 +30,16 @@ _captcha_pending = False
 _captcha_context = None
 _captcha_page = None
 
+# Selectors that indicate a visible CAPTCHA challenge
+CAPTCHA_SELECTORS = [
+    'iframe[src*="captcha"]', 
+    'iframe[src*="challenge"]',
+    '.captcha-container',
+    '#challenge-form',
+    '[class*="captcha"]',
+    '[id*="captcha"]',
+]
+
 
 class CopilotProvider(BaseProvider):
     """AI provider using Microsoft Copilot via Persistent Playwright Browser."""
@@ -109,16 +119,7 @@ class CopilotProvider(BaseProvider):
                     return True
             
             # Also check for specific selectors
-            captcha_selectors = [
-                'iframe[src*="captcha"]', 
-                'iframe[src*="challenge"]',
-                '.captcha-container',
-                '#challenge-form',
-                '[class*="captcha"]',
-                '[id*="captcha"]',
-            ]
-            
-            for selector in captcha_selectors:
+            for selector in CAPTCHA_SELECTORS:
                 try:
                     element = await page.query_selector(selector)
                     if element:
@@ -383,6 +384,30 @@ class CopilotProvider(BaseProvider):
         global _captcha_page
         return _captcha_page
 
+    @staticmethod
+    async def wait_for_captcha_cleared(timeout: float = 30) -> bool:
+        """
+        Wait until no CAPTCHA element is visible on the pending page.
+        Returns immediately if it is already gone; False on timeout.
+        """
+        page = _captcha_page
+        if not page:
+            return True
+        try:
+            await page.wait_for_function(
+                """(selectors) => !selectors.some(sel => {
+                    const el = document.querySelector(sel);
+                    return el && el.offsetParent !== null;
+                })""",
+                arg=CAPTCHA_SELECTORS,
+                timeout=timeout * 1000,
+                polling=200,
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"Copilot: CAPTCHA still present after {timeout}s: {e}")
+            return False
+
     @staticmethod
     def clear_captcha_pending():
         """Clear the CAPTCHA pending state."""
@@ -5,15 +5,41 @@ Supports custom IP proxy configuration with optional authentication.
 """
 
 import asyncio
-import aiohttp
+import httpx
 import logging
-from typing import Optional, Dict
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List
 from dataclasses import dataclass, field
 from datetime import datetime
 from urllib.parse import urlparse
 
+import metrics
+
 logger = logging.getLogger("kai_api.proxy_manager")
 
+_probe_ok = metrics.counter("proxy_probes_ok")
+_probe_failed = metrics.counter("proxy_probes_failed")
+_probe_latency = metrics.histogram("proxy_probe_latency_ms")
+_test_cached = metrics.counter("proxy_test_cached")
+
+PROXY_TEST_URL = "http://httpbin.org/ip"
+PROXY_TEST_TIMEOUT = 10
+# httpx binds a proxy to a client, so keep one pooled client per proxy and
+# reuse it across tests instead of reconnecting (and re-authing) every time
+PROXY_CLIENT_MAX = 32
+PROXY_TEST_CONCURRENCY = 20
+# While the current proxy keeps failing, /proxy/test reuses the last result
+# for a doubling interval instead of re-probing on every dashboard poll
+PROXY_TEST_BACKOFF_MIN = 0.5
+PROXY_TEST_BACKOFF_MAX = 60
+PROXY_CLIENT_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30)
+# Public list of free HTTP proxies ("ip:port" per line) for /proxy/fetch and
+# /proxy/rotate. These are unvetted third-party hosts: /proxy/rotate routes the
+# portals' browser traffic through one, so only use it with throwaway accounts.
+FREE_PROXY_LIST_URL = "https://api.proxyscrape.com/v2/?request=displayproxies&protocol=http&timeout=10000&country=all"
+FREE_PROXY_FETCH_TIMEOUT = 15
+
 @dataclass
 class Proxy:
     """Represents a proxy server with optional authentication."""
@@ -58,6 +84,11 @@ class ProxyManager:
     def __init__(self):
         self.custom_proxy: Optional[Proxy] = None
         self._proxy_str: Optional[str] = None
+        # proxy URL -> client, least recently used first
+        self._clients: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+        # Free proxies from the last fetch_proxies(), for rotation
+        self.proxy_pool: List[Proxy] = []
+        self._reset_test_backoff()
         
     def set_custom_proxy(self, proxy_str: str, username: Optional[str] = None, password: Optional[str] = None) -> bool:
         """
@@ -117,6 +148,7 @@ class ProxyManager:
                 last_tested=datetime.now()
             )
             self._proxy_str = str(self.custom_proxy)
+            self._reset_test_backoff()
             
             auth_info = f" with auth" if final_username else ""
             logger.info(f"✅ Custom proxy set: {self.custom_proxy.to_display_string()}{auth_info}")
@@ -130,6 +162,7 @@ class ProxyManager:
         """Clear the custom proxy."""
         self.custom_proxy = None
         self._proxy_str = None
+        self._reset_test_backoff()
         logger.info("🗑️ Custom proxy cleared")
     
     def get_current_proxy(self) -> Optional[Proxy]:
@@ -140,43 +173,166 @@ class ProxyManager:
         """Get the proxy string for environment variables."""
         return self._proxy_str
     
-    async def test_proxy(self, proxy: Optional[Proxy] = None) -> bool:
-        """Test if a proxy is working."""
+    async def test_proxy(self, proxy: Optional[Proxy] = None, pooled: bool = True) -> bool:
+        """
+        Test if a proxy is working. pooled=False uses a throwaway client,
+        for one-shot candidates that shouldn't take a slot in the pool.
+        """
         test_proxy = proxy or self.custom_proxy
         if not test_proxy:
             return False
         
+        if pooled:
+            client = self._get_client(str(test_proxy))
+        else:
+            client = httpx.AsyncClient(proxy=str(test_proxy), timeout=PROXY_TEST_TIMEOUT)
         try:
-            timeout = aiohttp.ClientTimeout(total=10)
-            
-            # Build proxy URL with auth if present
-            if test_proxy.username and test_proxy.password:
-                proxy_url = f"{test_proxy.protocol}://{test_proxy.username}:{test_proxy.password}@{test_proxy.ip}:{test_proxy.port}"
-            else:
-                proxy_url = f"{test_proxy.protocol}://{test_proxy.ip}:{test_proxy.port}"
+            start = asyncio.get_running_loop().time()
+            response = await client.get(PROXY_TEST_URL)
+            elapsed = asyncio.get_running_loop().time() - start
+            _probe_latency.observe(elapsed * 1000)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                start = asyncio.get_event_loop().time()
-                
-                async with session.get(
-                    "http://httpbin.org/ip",
-                    proxy=proxy_url,
-                    ssl=False
-                ) as response:
-                    elapsed = asyncio.get_event_loop().time() - start
-                    
-                    if response.status == 200:
-                        test_proxy.is_working = True
-                        test_proxy.response_time = elapsed
-                        test_proxy.last_tested = datetime.now()
-                        logger.info(f"✅ Proxy test passed: {elapsed:.2f}s")
-                        return True
-                    return False
+            if response.status_code == 200:
+                _probe_ok.inc()
+                test_proxy.is_working = True
+                test_proxy.response_time = elapsed
+                test_proxy.last_tested = datetime.now()
+                logger.info(f"✅ Proxy test passed: {elapsed:.2f}s")
+                return True
+            _probe_failed.inc()
+            return False
                         
         except Exception as e:
+            _probe_failed.inc()
             logger.warning(f"❌ Proxy test failed: {e}")
             test_proxy.is_working = False
             return False
+        finally:
+            if not pooled:
+                await client.aclose()
+    
+    async def test_current_proxy(self) -> bool:
+        """Test the current proxy, reusing a recent failure while backing off."""
+        if (self._last_test_result is False
+                and time.monotonic() - self._last_test_ts < self._test_backoff):
+            _test_cached.inc()
+            return False
+        
+        ok = await self.test_proxy()
+        self._last_test_ts = time.monotonic()
+        self._last_test_result = ok
+        if ok:
+            self._test_backoff = PROXY_TEST_BACKOFF_MIN
+        else:
+            self._test_backoff = min(self._test_backoff * 2, PROXY_TEST_BACKOFF_MAX)
+        return ok
+    
+    def _reset_test_backoff(self):
+        """Forget the last test result (the proxy changed)."""
+        self._last_test_ts = 0.0
+        self._last_test_result: Optional[bool] = None
+        self._test_backoff = PROXY_TEST_BACKOFF_MIN
+    
+    async def get_first_working_proxy(
+        self, candidates: List[Proxy], concurrency: int = PROXY_TEST_CONCURRENCY
+    ) -> Optional[Proxy]:
+        """
+        Test candidates concurrently and return the first that works (None if
+        none do). Candidates get throwaway clients, not pooled ones.
+        """
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def probe(proxy: Proxy) -> Optional[Proxy]:
+            async with sem:
+                return proxy if await self.test_proxy(proxy, pooled=False) else None
+        
+        tasks = [asyncio.create_task(probe(p)) for p in candidates]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                proxy = await next_done
+                if proxy:
+                    return proxy
+            return None
+        finally:
+            # Stop the slower probes once we have a winner
+            for task in tasks:
+                task.cancel()
+    
+    async def fetch_proxies(self, limit: int = 30) -> List[Proxy]:
+        """Replace the pool with up to `limit` free proxies from FREE_PROXY_LIST_URL."""
+        try:
+            async with httpx.AsyncClient(timeout=FREE_PROXY_FETCH_TIMEOUT) as client:
+                response = await client.get(FREE_PROXY_LIST_URL)
+                response.raise_for_status()
+        except Exception as e:
+            logger.error(f"❌ Failed to fetch free proxies: {e}")
+            return []
+        
+        proxies: List[Proxy] = []
+        seen = set()
+        for line in response.text.splitlines():
+            host, _, port = line.strip().rpartition(":")
+            if not host or not port.isdigit() or (host, port) in seen:
+                continue
+            seen.add((host, port))
+            proxies.append(Proxy(ip=host, port=int(port), country="Free"))
+            if len(proxies) >= limit:
+                break
+        
+        self.proxy_pool = proxies
+        logger.info(f"📥 Fetched {len(proxies)} free proxies")
+        return proxies
+    
+    async def rotate_proxy(self) -> Optional[Proxy]:
+        """Switch to a working proxy from the pool other than the current one."""
+        current = self.custom_proxy
+        candidates = [
+            p for p in self.proxy_pool
+            if not current or (p.ip, p.port) != (current.ip, current.port)
+        ]
+        new_proxy = await self.get_first_working_proxy(candidates)
+        if new_proxy:
+            self.set_custom_proxy(str(new_proxy))
+            logger.info(f"🔄 Rotated to proxy {new_proxy.to_display_string()}")
+        return new_proxy
+    
+    def get_proxy_stats(self) -> Dict:
+        """Counts for the fetched proxy pool."""
+        working = [p for p in self.proxy_pool if p.is_working]
+        return {
+            "total": len(self.proxy_pool),
+            "working": len(working),
+            "current": self.custom_proxy.to_display_string() if self.custom_proxy else None,
+        }
+    
+    def _get_client(self, proxy_url: str) -> httpx.AsyncClient:
+        """Get (or create) the pooled client that routes through a proxy."""
+        client = self._clients.get(proxy_url)
+        if client is not None:
+            self._clients.move_to_end(proxy_url)
+            return client
+        
+        if len(self._clients) >= PROXY_CLIENT_MAX:
+            _, oldest = self._clients.popitem(last=False)
+            asyncio.create_task(oldest.aclose())
+        
+        client = httpx.AsyncClient(
+            proxy=proxy_url,
+            timeout=PROXY_TEST_TIMEOUT,
+            limits=PROXY_CLIENT_LIMITS,
+            verify=False,
+        )
+        self._clients[proxy_url] = client
+        return client
+    
+    async def aclose(self):
+        """Close all pooled proxy clients (on app shutdown)."""
+        clients, self._clients = list(self._clients.values()), OrderedDict()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Failed to close proxy client: {e}")
     
     def get_status(self) -> Dict:
         """Get proxy status."""
@@ -0,0 +1,117 @@
+"""
+Rate Limiter
+------------
+Small in-process rate limiters, keyed by client (e.g. IP).
+RateLimiter (fixed window) stops /qaz/keys/lookup from being sprayed
+with guesses that each cost a database round-trip; TokenBucketLimiter
+caps overall request rate on the /qaz admin router.
+
+State is per process (no Redis/slowapi here): limits apply per worker.
+"""
+
+import time
+from typing import Callable, Dict, FrozenSet, Tuple
+
+from fastapi import HTTPException
+from fastapi.requests import HTTPConnection
+
+from config import TRUSTED_PROXY_HOPS
+
+
+def client_ip(conn: HTTPConnection) -> str:
+    """
+    Client address for rate limiting. Behind TRUSTED_PROXY_HOPS proxies the
+    socket peer is the proxy, so take the address the outermost trusted proxy
+    appended to X-Forwarded-For (entries further left are client-supplied).
+    """
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = [h.strip() for h in conn.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded:
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return conn.client.host if conn.client else "unknown"
+
+
+class RateLimiter:
+    """Allow at most `limit` hits per `window` seconds for each key."""
+
+    def __init__(self, limit: int, window: float = 60.0, key_func: Callable[[HTTPConnection], str] = client_ip):
+        self.limit = limit
+        self.window = window
+        self.key_func = key_func
+        # key -> (window_start, hits)
+        self._hits: Dict[str, Tuple[float, int]] = {}
+
+    def hit(self, key: str) -> bool:
+        """Record a hit for key. Returns False if it is over the limit."""
+        now = time.monotonic()
+        start, count = self._hits.get(key, (now, 0))
+        if now - start >= self.window:
+            start, count = now, 0
+            if len(self._hits) > 10_000:
+                self._prune(now)
+        if count >= self.limit:
+            return False
+        self._hits[key] = (start, count + 1)
+        return True
+
+    def _prune(self, now: float):
+        """Forget keys whose window has ended."""
+        expired = [k for k, (start, _) in self._hits.items() if now - start >= self.window]
+        for k in expired:
+            del self._hits[k]
+
+    def dependency(self, request: HTTPConnection):
+        """FastAPI dependency: 429 once the client is over the limit."""
+        if not self.hit(self.key_func(request)):
+            raise HTTPException(status_code=429, detail="Too many requests, slow down")
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket per key: up to `capacity` hits in a burst, refilled at
+    `rate` tokens per second. Smoother than a fixed window for clients
+    that poll steadily (e.g. the admin dashboard). Routes whose path
+    template is in `exempt` are not counted.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: int,
+        key_func: Callable[[HTTPConnection], str] = client_ip,
+        exempt: FrozenSet[str] = frozenset(),
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.key_func = key_func
+        self.exempt = exempt
+        # key -> (tokens, last_refill)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def hit(self, key: str) -> bool:
+        """Take one token for key. Returns False if the bucket is empty."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        if len(self._buckets) > 10_000 and key not in self._buckets:
+            self._prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def _prune(self, now: float):
+        """Forget keys whose bucket has refilled completely."""
+        full = [k for k, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.capacity]
+        for k in full:
+            del self._buckets[k]
+
+    def dependency(self, request: HTTPConnection):
+        """FastAPI dependency: 429 once the client has used up its bucket."""
+        route = request.scope.get("route")
+        if route is not None and getattr(route, "path", None) in self.exempt:
+            return
+        if not self.hit(self.key_func(request)):
+            raise HTTPException(status_code=429, detail="Too many requests, slow down")
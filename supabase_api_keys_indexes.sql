@@ -0,0 +1,23 @@
+-- ============================================
+-- K-AI API Gateway - kaiapi_api_keys indexes
+-- ============================================
+-- Run once in the Supabase SQL editor. CONCURRENTLY avoids locking the
+-- table, so each statement must run on its own (not inside a transaction).
+
+-- 1. Unique index for token lookups (/qaz/keys/lookup and API auth).
+--    The UNIQUE constraint on token already provides one on most installs;
+--    IF NOT EXISTS makes this a no-op there.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_kaiapi_api_keys_token_unique
+    ON kaiapi_api_keys(token);
+
+-- The plain (non-unique) token index from supabase_setup.sql is redundant
+-- with the unique one and only slows down writes.
+DROP INDEX CONCURRENTLY IF EXISTS idx_kaiapi_api_keys_token;
+
+-- 2. Ordered index for list_keys (ORDER BY created_at DESC).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_kaiapi_api_keys_created_at
+    ON kaiapi_api_keys(created_at DESC);
+
+-- 3. Verify (should show "Index Scan using idx_kaiapi_api_keys_token_unique",
+--    or the constraint's own index, not "Seq Scan")
+-- EXPLAIN ANALYZE SELECT id FROM kaiapi_api_keys WHERE token = 'sk-kai-...';
@@ -0,0 +1,10 @@
+-- ============================================
+-- K-AI API Gateway - kaiapi_api_keys.remaining
+-- ============================================
+-- Computes remaining quota in Postgres so /qaz/keys/lookup can select it
+-- directly (and so it can be filtered/indexed, e.g. WHERE remaining > 0).
+-- Must be applied before deploying the matching admin_router.py change.
+
+ALTER TABLE kaiapi_api_keys
+    ADD COLUMN IF NOT EXISTS remaining BIGINT
+    GENERATED ALWAYS AS (limit_tokens - usage_tokens) STORED;
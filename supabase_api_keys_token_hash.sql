@@ -0,0 +1,14 @@
+-- ============================================
+-- K-AI API Gateway - kaiapi_api_keys.token_hash
+-- ============================================
+-- SHA-256 of the token, kept in sync by Postgres (existing rows are
+-- filled in when the column is added), so /qaz/keys/lookup can match on
+-- the hash instead of sending the raw token in the query string.
+-- Must be applied before deploying the matching admin_router.py change.
+
+ALTER TABLE kaiapi_api_keys
+    ADD COLUMN IF NOT EXISTS token_hash CHAR(64)
+    GENERATED ALWAYS AS (encode(sha256(token::bytea), 'hex')) STORED;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_kaiapi_api_keys_token_hash
+    ON kaiapi_api_keys(token_hash);
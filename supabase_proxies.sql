@@ -78,6 +78,23 @@ CREATE TRIGGER update_kaiapi_proxies_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- ============================================
+-- Activate one proxy (and deactivate the rest) in a single statement
+-- ============================================
+-- Used by POST /qaz/proxies/{id}/activate. Returns the activated row,
+-- or nothing (and changes nothing) if the id doesn't exist.
+CREATE OR REPLACE FUNCTION activate_proxy(pid INTEGER)
+RETURNS SETOF kaiapi_proxies AS $$
+    WITH updated AS (
+        UPDATE kaiapi_proxies
+        SET is_active = (id = pid)
+        WHERE (is_active OR id = pid)
+          AND EXISTS (SELECT 1 FROM kaiapi_proxies WHERE id = pid)
+        RETURNING *
+    )
+    SELECT * FROM updated WHERE id = pid;
+$$ LANGUAGE sql;
+
 -- ============================================
 -- Useful Queries
 -- ============================================
@@ -88,8 +105,8 @@ CREATE TRIGGER update_kaiapi_proxies_updated_at
 -- Get default proxy:
 -- SELECT * FROM kaiapi_proxies WHERE is_default = true LIMIT 1;
 
--- Activate a proxy:
--- UPDATE kaiapi_proxies SET is_active = true WHERE id = 1;
+-- Activate a proxy (deactivating the others):
+-- SELECT * FROM activate_proxy(1);
 
 -- Deactivate a proxy:
 -- UPDATE kaiapi_proxies SET is_active = false WHERE id = 1;
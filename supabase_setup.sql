@@ -66,8 +66,20 @@ CREATE TABLE IF NOT EXISTS kaiapi_api_keys (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
-CREATE INDEX IF NOT EXISTS idx_kaiapi_api_keys_token ON kaiapi_api_keys(token);
+-- Remaining quota, computed by Postgres (see supabase_api_keys_remaining.sql)
+ALTER TABLE kaiapi_api_keys
+    ADD COLUMN IF NOT EXISTS remaining BIGINT
+    GENERATED ALWAYS AS (limit_tokens - usage_tokens) STORED;
+
+-- SHA-256 of the token, for lookups that shouldn't send the raw token
+ALTER TABLE kaiapi_api_keys
+    ADD COLUMN IF NOT EXISTS token_hash CHAR(64)
+    GENERATED ALWAYS AS (encode(sha256(token::bytea), 'hex')) STORED;
+
+-- token lookups use the UNIQUE constraint's index
 CREATE INDEX IF NOT EXISTS idx_kaiapi_api_keys_is_active ON kaiapi_api_keys(is_active);
+CREATE INDEX IF NOT EXISTS idx_kaiapi_api_keys_created_at ON kaiapi_api_keys(created_at DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_kaiapi_api_keys_token_hash ON kaiapi_api_keys(token_hash);
 
 -- ============================================
 -- STEP 3: Create kaiapi_model_stats table (if not exists)